@@ -3,12 +3,43 @@
 Incluye validación de calidad según porcentaje mínimo de píxeles válidos.
 """
 
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable
 
 import numpy as np
 import rasterio
 from loguru import logger
 
+from .numba_compat import guvectorize
+
+
+def _norm_diff_loop(a: np.ndarray, b: np.ndarray, out: np.ndarray) -> None:
+    """(a - b)/(a + b) sobre una fila; 0 si el denominador es 0, NaN se propaga."""
+    for j in range(a.shape[0]):
+        den = a[j] + b[j]
+        if den != 0.0:
+            out[j] = (a[j] - b[j]) / den
+        else:
+            out[j] = 0.0
+
+
+@lru_cache(maxsize=1)
+def _norm_diff_kernel() -> Callable[..., np.ndarray]:
+    """Compila en el primer uso el núcleo por fila "(m),(m)->(m)".
+
+    Con firma explícita guvectorize compila al decorar; diferirlo evita pagar
+    la compilación en cada `import pascal_zoning`. Con target="parallel" las
+    filas del raster se reparten entre hilos. Sin fastmath para conservar la
+    semántica de NaN.
+    """
+    return guvectorize(
+        ["void(float32[:], float32[:], float32[:])"],
+        "(m),(m)->(m)",
+        target="parallel",
+        cache=True,
+    )(_norm_diff_loop)
+
 
 class NDVIBlockInterface:
     """Interfaz para manejar datos espectrales de un bloque satelital."""
@@ -28,24 +59,31 @@ class NDVIBlockInterface:
         self.quality_threshold = quality_threshold
 
     @staticmethod
-    def safe_divide(a_arr: np.ndarray, b_arr: np.ndarray) -> np.ndarray:
+    def safe_divide(
+        a_arr: np.ndarray, b_arr: np.ndarray, den: np.ndarray | None = None
+    ) -> np.ndarray:
         """Calcula (a - b)/(a + b) evitando división por cero.
 
         - Si a o b es NaN, el resultado será NaN.
         - Si (a + b) == 0 (sin NaN), devuelve 0.0 para evitar excepción.
+
+        El numerador se escribe directo en la salida float32 y `den` permite
+        reutilizar un buffer float32 para el denominador entre llamadas. Con
+        numba y entradas float32 se usa el núcleo compilado `_norm_diff_kernel`.
         """
-        mask_input_nan = np.isnan(a_arr) | np.isnan(b_arr)
-
-        with np.errstate(divide="ignore", invalid="ignore"):
-            numerador = a_arr - b_arr
-            denominador = a_arr + b_arr
-            resultado = np.divide(
-                numerador,
-                denominador,
-                out=np.zeros_like(a_arr, dtype=np.float32),
-                where=(denominador != 0),
-            )
-        resultado[mask_input_nan] = np.nan
+        if (
+            guvectorize is not None
+            and a_arr.dtype == np.float32
+            and b_arr.dtype == np.float32
+        ):
+            return _norm_diff_kernel()(a_arr, b_arr)
+
+        resultado = np.subtract(a_arr, b_arr, dtype=np.float32)
+        denominador = np.add(a_arr, b_arr, out=den, dtype=np.float32)
+        # NaN != 0, así que los NaN de entrada se propagan por la división.
+        nonzero = denominador != 0
+        np.divide(resultado, denominador, out=resultado, where=nonzero)
+        resultado[~nonzero] = 0.0
         return resultado
 
     def load_spectral_indices(
@@ -79,16 +117,17 @@ class NDVIBlockInterface:
             b6 = src.read(6).astype(np.float32)
 
         resultados: dict[str, np.ndarray] = {}
+        den = np.empty_like(b2)
         for idx in names:
             idx_lower = idx.lower().strip()
             if idx_lower == "ndvi":
-                resultados["ndvi"] = self.safe_divide(b4, b3)
+                resultados["ndvi"] = self.safe_divide(b4, b3, den)
             elif idx_lower == "ndwi":
-                resultados["ndwi"] = self.safe_divide(b2, b4)
+                resultados["ndwi"] = self.safe_divide(b2, b4, den)
             elif idx_lower == "ndre":
-                resultados["ndre"] = self.safe_divide(b4, b5)
+                resultados["ndre"] = self.safe_divide(b4, b5, den)
             elif idx_lower == "si":
-                resultados["si"] = self.safe_divide(b3, b6)
+                resultados["si"] = self.safe_divide(b3, b6, den)
             else:
                 raise ValueError(f"Índice desconocido: {idx}")
 
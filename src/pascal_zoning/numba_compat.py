@@ -0,0 +1,14 @@
+"""Importación opcional de numba (extra "fast").
+
+Sin numba, `njit` y `guvectorize` quedan en None y `prange` es `range`; los
+módulos que compilan núcleos usan entonces su ruta NumPy.
+"""
+
+try:  # numba es opcional (extra "fast"); sin él se usa la ruta NumPy.
+    from numba import guvectorize, njit, prange
+except ImportError:  # pragma: no cover - depende del entorno
+    guvectorize = None
+    njit = None
+    prange = range  # type: ignore[misc]
+
+__all__ = ["guvectorize", "njit", "prange"]
@@ -18,17 +18,19 @@ import numpy as np
 import rasterio
 from loguru import logger
 import typer
-from shapely.geometry import shape as shape_from_geojson
-from shapely.geometry.base import BaseGeometry
-from shapely.ops import unary_union
-from rasterio.features import shapes
 
 # Importaciones de aplicación local
 from .config import load_config, ZoningConfig
 from .interface import NDVIBlockInterface
 from .logging_config import setup_logging
 from .viz import zoning_overview
-from .zoning import AgriculturalZoning, ProcessingError, ZoningResult
+from .zoning import (
+    AgriculturalZoning,
+    ZoningResult,
+    _format_metric,
+    gdal_env_options,
+    raster_mask_to_polygon,
+)
 
 app = typer.Typer(help="Script principal para zonificación agronómica.")
 
@@ -92,26 +94,13 @@ class ZoningPipeline:
 
         block_folder = raster_path.parent
         block = NDVIBlockInterface(data_path=block_folder)
-        indices_dict = _load_indices(block, index_names)
-
-        with rasterio.open(raster_path) as src:
-            crs = src.crs.to_string() if src.crs is not None else ""
-            transform = src.transform
-            banda1 = src.read(1)
-            mask_valid = (banda1 > 0).astype(np.uint8)
-
-            geoms: list[BaseGeometry] = []
-            for geom_geojson, val in shapes(
-                mask_valid, mask=mask_valid, transform=transform
-            ):
-                if val == 1:
-                    geoms.append(shape_from_geojson(geom_geojson))
-
-            if not geoms:
-                raise ProcessingError(
-                    "No se pudo derivar polígono: todos los píxeles están en 0."
-                )
-            polygon_union = unary_union(geoms)
+        # Un solo entorno GDAL para todas las lecturas del raster.
+        with rasterio.Env(**gdal_env_options(raster_path)):
+            indices_dict = _load_indices(block, index_names)
+
+            with rasterio.open(raster_path) as src:
+                crs = src.crs.to_string() if src.crs is not None else ""
+                polygon_union = raster_mask_to_polygon(src, band=1)
 
         bounds = polygon_union
         tamaño_zona = tamaño
@@ -121,6 +110,7 @@ class ZoningPipeline:
             min_zone_size_ha=tamaño_zona,
             max_zones=self.config.max_zones,
             output_dir=carpeta_base,
+            n_jobs=self.config.n_jobs if self.config.parallel_processing else 1,
         )
 
         result = engine.run_pipeline(
@@ -213,7 +203,10 @@ def run(
 
         logger.info(f"Se generaron {len(result.zones)} zonas de manejo.")
         logger.info(f"Se generaron {len(result.samples)} puntos de muestreo.")
-        logger.info(f"Índice de silhouette: {result.metrics.silhouette:.3f}.")
+        logger.info(
+            "Índice de silhouette: "
+            f"{_format_metric(result.metrics.silhouette, '.3f')}."
+        )
 
     except Exception as e:
         logger.error(f"Error durante la zonificación: {e}")
@@ -280,7 +273,10 @@ def zonificar(
 
         logger.info(f"Se generaron {len(result.zones)} zonas de manejo.")
         logger.info(f"Se generaron {len(result.samples)} puntos de muestreo.")
-        logger.info(f"Índice de silhouette: {result.metrics.silhouette:.3f}.")
+        logger.info(
+            "Índice de silhouette: "
+            f"{_format_metric(result.metrics.silhouette, '.3f')}."
+        )
 
     except Exception as e:
         logger.error(f"Error durante la zonificación: {e}")
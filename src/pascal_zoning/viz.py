@@ -9,6 +9,7 @@ import collections.abc
 import matplotlib.pyplot as plt
 import matplotlib
 import geopandas as gpd
+import shapely
 from shapely.geometry import MultiPolygon, Polygon, LinearRing
 from loguru import logger
 
@@ -88,7 +89,9 @@ def zoning_overview(
                     axes[0].fill(x_h, y_h, facecolor="white")
 
         # Plotear contorno total (línea exterior)
-        boundary = gpd.GeoDataFrame(geometry=[zones.unary_union], crs=zones.crs)
+        # Unión vectorizada de shapely 2 sobre el arreglo de geometrías.
+        contorno = shapely.unary_union(zones.geometry.values)
+        boundary = gpd.GeoDataFrame(geometry=[contorno], crs=zones.crs)
         boundary.boundary.plot(ax=axes[0], color="black", linewidth=1)
 
         # Ajustar límites con un pequeño margen
@@ -2,26 +2,32 @@
 
 from __future__ import annotations
 
+import csv
+import hashlib
 import json
 import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union, cast
+from typing import IO, Any, Callable, Dict, List, Optional, Union
 
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import numpy as np
 import numpy.typing as npt
-import pandas as pd
 import rasterio
+import shapely
+from joblib import Parallel, delayed, effective_n_jobs
 from matplotlib.colors import Normalize
 from rasterio.features import geometry_mask, shapes
 from rasterio.transform import Affine
-from shapely.geometry import Polygon, Point, shape
+from rasterio.windows import Window
+from shapely.geometry import MultiPolygon, Polygon, Point
 from shapely.geometry.base import BaseGeometry
-from shapely.ops import unary_union
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.decomposition import PCA
 from sklearn.impute import SimpleImputer
 from sklearn.metrics import (
@@ -30,17 +36,74 @@ from sklearn.metrics import (
 )
 from sklearn.preprocessing import StandardScaler
 
+from .numba_compat import njit, prange
+
 # Definir tipos personalizados
 FloatArray = npt.NDArray[np.float64]
+Float32Array = npt.NDArray[np.float32]
 BoolArray = npt.NDArray[np.bool_]
 IntArray = npt.NDArray[np.int32]
-NDArray = Union[FloatArray, BoolArray, IntArray]
+NDArray = Union[FloatArray, Float32Array, BoolArray, IntArray]
 GeometryType = Union[Polygon, Point, BaseGeometry]
 
+# Tamaño de lote de MiniBatchKMeans durante el barrido de k.
+KMEANS_BATCH_SIZE = 4096
+
+# Sobre este número de píxeles el ajuste final también usa MiniBatchKMeans.
+KMEANS_FULL_MAX_SAMPLES = 100_000
+
+# Silhouette es O(n²) en píxeles; sobre ~5000 muestras converge a <1 %.
+SILHOUETTE_SAMPLE_SIZE = 5000
+
+# Sobre este número de píxeles se usa la Silhouette simplificada (distancias a
+# centroides, O(n·k)) en lugar de la Silhouette submuestreada.
+SIMPLIFIED_SILHOUETTE_MIN_SAMPLES = 50_000
+
+# Filas por bloque al calcular distancias a centroides.
+SILHOUETTE_CHUNK_ROWS = 65_536
+
+# Bandas (a, b) de cada índice de diferencia normalizada (a - b)/(a + b).
+INDEX_PAIRS: Dict[str, tuple[str, str]] = {
+    "NDVI": ("nir", "red"),
+    "NDWI": ("green", "nir"),
+    "NDRE": ("nir", "red_edge"),
+    "SI": ("swir", "nir"),
+}
+
+# Opciones GDAL para las lecturas de rasters: caché de bloques de 512 MB y
+# caché VSI.
+GDAL_ENV_OPTIONS: Dict[str, Any] = {
+    "GDAL_CACHEMAX": 512,
+    "VSI_CACHE": True,
+}
+
+# Solo para rasters remotos (/vsi*, URL): no listar el directorio al abrir ni
+# pedir archivos que no sean .tif. En disco local desactivaría los archivos
+# auxiliares (.tfw, .aux.xml, .msk, .ovr) y con ellos la georreferencia.
+REMOTE_GDAL_ENV_OPTIONS: Dict[str, Any] = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif",
+}
+
+# Filas por lectura al poligonizar la máscara de un raster por ventanas
+# (se redondea a un múltiplo de la altura de bloque del archivo).
+MASK_READ_ROWS = 512
+
+# k consecutivos sin mejora de Silhouette antes de cortar el barrido.
+SILHOUETTE_PATIENCE = 2
+
+# Versión del formato de la caché de `_load_raster_inputs_cached`. Forma parte
+# de la clave: se incrementa cuando cambian dtype o reglas de los índices para
+# que las entradas antiguas no se reutilicen.
+RASTER_CACHE_VERSION = 2
+
 
 @dataclass
 class ClusterMetrics:
-    """Métricas de calidad del clustering."""
+    """Métricas de calidad del clustering.
+
+    `silhouette` y `calinski_harabasz` son NaN cuando k se fijó con `force_k`.
+    """
 
     n_clusters: int
     silhouette: float
@@ -90,6 +153,188 @@ class ProcessingError(ZonificationError):
     pass
 
 
+def _farthest_point_indices(coords: FloatArray, n_points: int, first: int) -> List[int]:
+    """Selecciona `n_points` índices de `coords` por inhibición espacial.
+
+    Mantiene la distancia mínima de cada candidato al conjunto elegido y la
+    actualiza solo contra el último punto añadido (O(n·k) en vez de O(n·k²)).
+    Los ya elegidos se marcan con -inf para que `argmax` no los repita.
+    Si numba está disponible se usa el kernel compilado equivalente.
+    """
+    if _farthest_point_kernel is not None:
+        coords64 = np.ascontiguousarray(coords, dtype=np.float64)
+        return [int(i) for i in _farthest_point_kernel(coords64, n_points, first)]
+
+    min_dists = np.full(coords.shape[0], np.inf)
+    min_dists[first] = -np.inf
+    selected = [first]
+    while len(selected) < n_points:
+        dists = np.linalg.norm(coords - coords[selected[-1]], axis=1)
+        np.minimum(min_dists, dists, out=min_dists)
+        best = int(np.argmax(min_dists))
+        min_dists[best] = -np.inf
+        selected.append(best)
+    return selected
+
+
+def _farthest_point_loop(
+    coords: FloatArray, n_points: int, first: int
+) -> npt.NDArray[np.int64]:
+    """Núcleo de `_farthest_point_indices` en bucles planos para numba.
+
+    Actualiza distancias y busca el máximo en la misma pasada, sin buffers
+    temporales por iteración. Ante empates conserva el primer índice, igual
+    que `np.argmax`.
+    """
+    n, dims = coords.shape
+    min_dists = np.full(n, np.inf)
+    min_dists[first] = -np.inf
+    selected = np.empty(n_points, dtype=np.int64)
+    selected[0] = first
+    last = first
+    for k in range(1, n_points):
+        best = -1
+        best_dist = -np.inf
+        for i in range(n):
+            dist_i = min_dists[i]
+            if dist_i != -np.inf:
+                acc = 0.0
+                for j in range(dims):
+                    diff = coords[i, j] - coords[last, j]
+                    acc += diff * diff
+                dist_new = np.sqrt(acc)
+                if dist_new < dist_i:
+                    dist_i = dist_new
+                    min_dists[i] = dist_i
+            if dist_i > best_dist:
+                best_dist = dist_i
+                best = i
+        min_dists[best] = -np.inf
+        selected[k] = best
+        last = best
+    return selected
+
+
+_farthest_point_kernel = (
+    njit(cache=True)(_farthest_point_loop) if njit is not None else None
+)
+
+
+def _polygons_from_geojson(
+    geoms: List[Dict[str, Any]],
+) -> npt.NDArray[np.object_]:
+    """Construye en bloque los polígonos GeoJSON que entrega `shapes`.
+
+    Aplana todos los anillos en un único arreglo de coordenadas y arma
+    anillos y polígonos con las funciones vectorizadas de shapely (el primer
+    anillo de cada polígono es el exterior y el resto, huecos), en vez de un
+    `shape()` por geometría.
+    """
+    rings = [ring for geom in geoms for ring in geom["coordinates"]]
+    ring_sizes = np.fromiter((len(ring) for ring in rings), np.intp, len(rings))
+    coords = np.fromiter(
+        (v for ring in rings for xy in ring for v in xy),
+        np.float64,
+        2 * int(ring_sizes.sum()),
+    ).reshape(-1, 2)
+    ring_geoms = shapely.linearrings(
+        coords, indices=np.repeat(np.arange(len(rings)), ring_sizes)
+    )
+    rings_per_poly = [len(geom["coordinates"]) for geom in geoms]
+    return shapely.polygons(
+        ring_geoms, indices=np.repeat(np.arange(len(geoms)), rings_per_poly)
+    )
+
+
+def gdal_env_options(raster_path: Union[str, Path]) -> Dict[str, Any]:
+    """Opciones de `rasterio.Env` para leer `raster_path`.
+
+    Agrega REMOTE_GDAL_ENV_OPTIONS solo si la ruta es /vsi* o una URL.
+    """
+    path = str(raster_path)
+    remote = path.startswith("/vsi") or "://" in path
+    if remote:
+        return {**GDAL_ENV_OPTIONS, **REMOTE_GDAL_ENV_OPTIONS}
+    return dict(GDAL_ENV_OPTIONS)
+
+
+def _format_metric(value: float, spec: str) -> str:
+    """Formatea una métrica para logs; "n/a" si no se calculó (NaN)."""
+    return "n/a" if np.isnan(value) else format(value, spec)
+
+
+def _json_metric(value: float) -> Optional[float]:
+    """Métrica serializable en JSON: null en lugar de NaN."""
+    return None if np.isnan(value) else float(value)
+
+
+def _sampled_silhouette(
+    features: Float32Array, labels: npt.NDArray[np.int_], random_state: int
+) -> float:
+    """Silhouette sobre una submuestra de a lo más SILHOUETTE_SAMPLE_SIZE."""
+    return float(
+        silhouette_score(
+            features,
+            labels,
+            sample_size=min(SILHOUETTE_SAMPLE_SIZE, labels.size),
+            random_state=random_state,
+        )
+    )
+
+
+def _simplified_silhouette(
+    kmeans: Union[KMeans, MiniBatchKMeans], features: Float32Array
+) -> float:
+    """Silhouette simplificada: a = centroide más cercano, b = el segundo.
+
+    Usa las distancias de `kmeans.transform` por bloques de filas, así que el
+    costo es O(n·k) como una iteración de KMeans y la memoria no crece con n.
+    """
+    total = 0.0
+    for start in range(0, features.shape[0], SILHOUETTE_CHUNK_ROWS):
+        dist = kmeans.transform(features[start : start + SILHOUETTE_CHUNK_ROWS])
+        two_nearest = np.partition(dist, 1, axis=1)[:, :2]
+        a = two_nearest[:, 0]
+        b = two_nearest[:, 1]
+        denom = np.maximum(a, b)
+        total += float(
+            np.divide(b - a, denom, out=np.zeros_like(a), where=denom > 0).sum()
+        )
+    return total / features.shape[0]
+
+
+def _clustering_silhouette(
+    kmeans: Union[KMeans, MiniBatchKMeans],
+    features: Float32Array,
+    labels: npt.NDArray[np.int_],
+    random_state: int,
+) -> float:
+    """Silhouette del ajuste: simplificada para muchos píxeles, si no muestreada."""
+    if labels.size > SIMPLIFIED_SILHOUETTE_MIN_SAMPLES:
+        return _simplified_silhouette(kmeans, features)
+    return _sampled_silhouette(features, labels, random_state)
+
+
+def _evaluate_k(
+    k: int, features: Float32Array, random_state: int
+) -> tuple[int, float, float]:
+    """Ajusta MiniBatchKMeans con `k` clusters y retorna (k, Silhouette, CH)."""
+    kmeans = MiniBatchKMeans(
+        n_clusters=k,
+        batch_size=KMEANS_BATCH_SIZE,
+        n_init=1,
+        random_state=random_state,
+    )
+    labels = kmeans.fit_predict(features)
+    try:
+        sil_score = _clustering_silhouette(kmeans, features, labels, random_state)
+        ch_score = float(calinski_harabasz_score(features, labels))
+    except ValueError:
+        sil_score = -1.0
+        ch_score = 0.0
+    return k, sil_score, ch_score
+
+
 class AgriculturalZoning:
     """Sistema de zonificación agronómica basado en ML.
 
@@ -106,6 +351,8 @@ class AgriculturalZoning:
         min_zone_size_ha: float = 0.5,
         max_zones: int = 10,
         output_dir: Optional[Path] = None,
+        use_pca: bool = False,
+        n_jobs: int = -1,
     ) -> None:
         """Inicializa el sistema con parámetros de clustering y salida.
 
@@ -114,22 +361,38 @@ class AgriculturalZoning:
             min_zone_size_ha: Tamaño mínimo de zona en hectáreas.
             max_zones: Número máximo de zonas a evaluar.
             output_dir: Directorio opcional para resultados.
+            use_pca: Si es True, reduce las características con PCA (95 %
+                de varianza) antes del clustering.
+            n_jobs: Procesos para evaluar candidatos de k en paralelo
+                (-1 usa todos los núcleos).
         """
         self.random_state = random_state
         self.min_zone_size_ha = min_zone_size_ha
         self.max_zones = max_zones
         self.output_dir = output_dir
-
-        # Componentes de preprocesamiento ML
-        self.scaler = StandardScaler()
-        self.pca = PCA(n_components=0.95, svd_solver="full")
+        self.n_jobs = n_jobs
+
+        # Componentes de preprocesamiento ML. Con pocas características y
+        # muchos píxeles, svd_solver="auto" usa la descomposición de la
+        # covarianza (O(n·p²)) en lugar de la SVD completa. El escalado se
+        # hace en sitio sobre la salida del imputer (ya es una copia propia).
+        self.scaler = StandardScaler(copy=False)
+        self.pca: Optional[PCA] = (
+            PCA(n_components=0.95, svd_solver="auto", random_state=random_state)
+            if use_pca
+            else None
+        )
         self.imputer = SimpleImputer(strategy="median")
 
         # Estado interno
-        self.features_array: Optional[NDArray] = None
-        self.valid_mask: Optional[NDArray] = None
+        self.features_array: Optional[Float32Array] = None
+        self.valid_mask: Optional[BoolArray] = None
+        self.valid_pixel_idx: Optional[npt.NDArray[np.intp]] = None
         self.indices: Dict[str, NDArray] = {}
-        self.cluster_labels: Optional[NDArray] = None
+        self.cluster_labels: Optional[IntArray] = None
+        self.cluster_pixel_idx: Dict[int, npt.NDArray[np.intp]] = {}
+        self.zone_id_lut: Optional[IntArray] = None
+        self.zone_cluster_labels: Optional[IntArray] = None
         self.n_clusters_opt: Optional[int] = None
         self.zones_gdf: Optional[gpd.GeoDataFrame] = None
         self.samples_gdf: Optional[gpd.GeoDataFrame] = None
@@ -148,12 +411,6 @@ class AgriculturalZoning:
         # Logger
         self.logger = logging.getLogger("AgriculturalZoning")
 
-    def _get_bounds(self) -> tuple[float, float, float, float]:
-        """Obtiene límites (left, bottom, right, top) de los bounds."""
-        if self.bounds is None:
-            raise ProcessingError("Bounds no inicializados.")
-        return self.bounds.bounds
-
     def create_mask(self) -> None:
         """Crea máscara booleana que indica píxeles dentro del polígono."""
         if self.gdf_predio is None:
@@ -167,13 +424,9 @@ class AgriculturalZoning:
         if not isinstance(geom, BaseGeometry):
             raise ProcessingError("La geometría debe ser un objeto Shapely.")
 
-        if hasattr(geom, "__geo_interface__"):
-            polygon_geom = [geom.__geo_interface__]
-        else:
-            raise ProcessingError("La geometría no implementa __geo_interface__.")
-
+        # rasterio acepta la geometría Shapely directamente (__geo_interface__).
         mask_poly = geometry_mask(
-            geometries=polygon_geom,
+            geometries=[geom],
             out_shape=(self.height, self.width),
             transform=self.transform,
             invert=True,
@@ -182,20 +435,28 @@ class AgriculturalZoning:
         if not self.indices:
             raise ProcessingError("No hay índices inicializados.")
 
+        # Reducción in situ índice a índice: sin apilar un (H, W, B) temporal.
+        valid_data_mask = np.ones((self.height, self.width), dtype=bool)
         for name, array in self.indices.items():
-            nan_count = int(np.sum(np.isnan(array)))
+            nan_mask = np.isnan(array)
+            nan_count = int(np.sum(nan_mask))
             if nan_count > 0:
                 self.logger.warning(
                     f"Índice {name}: {nan_count} valores NaN detectados."  # noqa: E501
                 )
+            np.logical_and(valid_data_mask, ~nan_mask, out=valid_data_mask)
 
-        stacked = np.stack(list(self.indices.values()), axis=-1)
-        valid_data_mask = np.all(~np.isnan(stacked), axis=-1)
+        n_poly = int(np.count_nonzero(mask_poly))
+        n_data = int(np.count_nonzero(valid_data_mask))
 
-        self.valid_mask = np.logical_and(mask_poly, valid_data_mask)
-        n_valid = int(np.sum(cast(np.ndarray, self.valid_mask)))
-        n_poly = int(np.sum(mask_poly))
-        n_data = int(np.sum(valid_data_mask))
+        # valid_mask queda como bool contiguo (combinado in situ sobre el buffer
+        # anterior); las etapas siguientes lo usan sin volver a castearlo.
+        self.valid_mask = np.logical_and(
+            mask_poly, valid_data_mask, out=valid_data_mask
+        )
+        # Posiciones planas de los píxeles válidos; se reutilizan en cada etapa.
+        self.valid_pixel_idx = np.flatnonzero(self.valid_mask)
+        n_valid = int(self.valid_pixel_idx.size)
 
         self.logger.info(f"Píxeles dentro del polígono: {n_poly}.")
         self.logger.info(f"Píxeles con datos válidos: {n_data}.")
@@ -212,47 +473,81 @@ class AgriculturalZoning:
 
     def prepare_feature_matrix(self) -> None:
         """Prepara la matriz de características a partir de los índices."""
-        if self.valid_mask is None:
+        if self.valid_pixel_idx is None:
             raise ProcessingError("Máscara de validez no inicializada.")
 
-        index_arrays = [np.asarray(arr) for arr in self.indices.values()]
-        feature_stack = np.stack(index_arrays, axis=-1)
-        valid_mask_array = np.asarray(self.valid_mask, dtype=bool)
-        features_valid = feature_stack[valid_mask_array].reshape(-1, len(self.indices))
+        # Una sola matriz contigua (n_válidos, n_índices) en float32, llenada
+        # columna a columna solo con los píxeles válidos (sin apilar H×W×B).
+        # Se descartó reunir filas de una matriz (H·W, B) por píxel: exigía
+        # detectar el diseño del llamador por punteros y ahorraba ~0.15 s en
+        # 16 M píxeles.
+        valid_idx = self.valid_pixel_idx
+        features_valid = np.empty((valid_idx.size, len(self.indices)), dtype=np.float32)
+        for col, arr in enumerate(self.indices.values()):
+            features_valid[:, col] = np.take(arr, valid_idx)
 
         X_imputed = self.imputer.fit_transform(features_valid)
         X_scaled = self.scaler.fit_transform(X_imputed)
-        self.features_array = np.array(X_scaled, dtype=np.float64)
+        if self.pca is not None:
+            X_scaled = self.pca.fit_transform(X_scaled)
+            self.logger.info(f"PCA: {self.pca.n_components_} componentes retenidas.")
+        # Toda la cadena conserva float32: KMeans y las métricas de selección
+        # leen la mitad de bytes por iteración que con float64.
+        self.features_array = np.ascontiguousarray(X_scaled, dtype=np.float32)
 
         self.logger.info(
             "Matriz de características imputada y escalada para clustering."
         )
 
     def select_optimal_clusters(self) -> int:
-        """Evalúa k=2…max_zones y retorna k óptimo según Silhouette."""
+        """Evalúa k=2…max_zones y retorna k óptimo según Silhouette.
+
+        El barrido usa MiniBatchKMeans con una sola inicialización por k
+        (solo importa el orden relativo de los puntajes) y reparte los k
+        candidatos entre `n_jobs` procesos. Se detiene antes de max_zones si
+        Silhouette no mejora en SILHOUETTE_PATIENCE k consecutivos. El ajuste
+        definitivo con KMeans completo se hace solo para el k elegido en
+        `perform_clustering`.
+        """
         if self.features_array is None:
             raise ProcessingError("Matriz de características no inicializada.")
 
         best_k = 2
         best_score = -np.inf
+        no_improve = 0
+        candidates = list(range(2, self.max_zones + 1))
+
+        # Los k se evalúan en paralelo por bloques del tamaño del pool y se
+        # recorren en orden; se corta cuando Silhouette no mejora en
+        # SILHOUETTE_PATIENCE valores consecutivos de k.
+        chunk = max(1, effective_n_jobs(self.n_jobs))
+        with Parallel(n_jobs=self.n_jobs, backend="loky") as parallel:
+            for start in range(0, len(candidates), chunk):
+                results = parallel(
+                    delayed(_evaluate_k)(k, self.features_array, self.random_state)
+                    for k in candidates[start : start + chunk]
+                )
 
-        for k in range(2, self.max_zones + 1):
-            kmeans = KMeans(n_clusters=k, random_state=self.random_state)
-            labels = kmeans.fit_predict(self.features_array)
-            try:
-                sil_score = float(silhouette_score(self.features_array, labels))
-                ch_score = float(calinski_harabasz_score(self.features_array, labels))
-            except ValueError:
-                sil_score = -1.0
-                ch_score = 0.0
-
-            self.logger.info(
-                f"k={k}: Silhouette={sil_score:.4f}, " f"CH={ch_score:.2f}."
-            )
+                for k, sil_score, ch_score in results:
+                    self.logger.info(
+                        f"k={k}: Silhouette={sil_score:.4f}, " f"CH={ch_score:.2f}."
+                    )
 
-            if sil_score > best_score:
-                best_score = sil_score
-                best_k = k
+                    if sil_score > best_score:
+                        best_score = sil_score
+                        best_k = k
+                        no_improve = 0
+                    else:
+                        no_improve += 1
+                        if no_improve >= SILHOUETTE_PATIENCE:
+                            break
+
+                if no_improve >= SILHOUETTE_PATIENCE:
+                    self.logger.info(
+                        f"Búsqueda detenida en k={k}: Silhouette sin mejora en "
+                        f"{SILHOUETTE_PATIENCE} valores consecutivos."
+                    )
+                    break
 
         self.logger.info(
             f"Seleccionado k óptimo = {best_k} con Silhouette = " f"{best_score:.4f}."
@@ -270,23 +565,47 @@ class AgriculturalZoning:
         else:
             self.n_clusters_opt = self.select_optimal_clusters()
 
-        kmeans_final = KMeans(
-            n_clusters=self.n_clusters_opt,
-            random_state=self.random_state,
-        )
+        # Elkan sobre float32 para tamaños moderados; con muchos píxeles cada
+        # iteración de Lloyd/Elkan recorre toda la matriz, así que se usa
+        # MiniBatchKMeans con algunas inicializaciones.
+        kmeans_final: Union[KMeans, MiniBatchKMeans]
+        if self.features_array.shape[0] > KMEANS_FULL_MAX_SAMPLES:
+            kmeans_final = MiniBatchKMeans(
+                n_clusters=self.n_clusters_opt,
+                batch_size=KMEANS_BATCH_SIZE,
+                n_init=3,
+                random_state=self.random_state,
+            )
+        else:
+            kmeans_final = KMeans(
+                n_clusters=self.n_clusters_opt,
+                algorithm="elkan",
+                random_state=self.random_state,
+            )
         labels_flat = kmeans_final.fit_predict(self.features_array)
 
         if self.height is None or self.width is None:
             raise ProcessingError("Dimensiones no inicializadas.")
+        if self.valid_pixel_idx is None:
+            raise ProcessingError("Máscara de validez no inicializada.")
 
         clusters_img = np.full((self.height, self.width), -1, dtype=np.int32)
+        np.put(clusters_img, self.valid_pixel_idx, labels_flat)
+
+        self.cluster_labels = clusters_img
+        # Etiquetas nuevas: la traducción a zonas la rehace filter_small_zones.
+        self.zone_id_lut = None
+        self.zone_cluster_labels = None
 
-        valid_mask_array = np.asarray(self.valid_mask, dtype=bool)
-        clusters_img[valid_mask_array] = labels_flat
+        # Índices planos de los píxeles de cada cluster (orden fila-mayor),
+        # calculados en una sola pasada para estadísticas y muestreo.
+        unique, counts = np.unique(labels_flat, return_counts=True)
+        order = np.argsort(labels_flat, kind="stable")
+        groups = np.split(self.valid_pixel_idx[order], np.cumsum(counts)[:-1])
+        self.cluster_pixel_idx = {int(u): g for u, g in zip(unique, groups)}
 
-        self.cluster_labels = clusters_img.astype(np.float64)
         total_pixels = self.height * self.width
-        valid_pixels = int(np.sum(valid_mask_array))
+        valid_pixels = int(self.valid_pixel_idx.size)
         labeled_pixels = int(np.sum(clusters_img >= 0))
 
         self.logger.info(f"Total píxeles: {total_pixels}.")
@@ -299,9 +618,16 @@ class AgriculturalZoning:
             )
 
         inertia = float(kmeans_final.inertia_)
-        sil_score = float(silhouette_score(self.features_array, labels_flat))
-        ch_score = float(calinski_harabasz_score(self.features_array, labels_flat))
-        unique, counts = np.unique(labels_flat, return_counts=True)
+        # Silhouette y CH solo sirven para elegir k: con k forzado se omiten
+        # (NaN) y quedan solo la inercia y los tamaños que entrega el ajuste.
+        if force_k is None:
+            sil_score = _clustering_silhouette(
+                kmeans_final, self.features_array, labels_flat, self.random_state
+            )
+            ch_score = float(calinski_harabasz_score(self.features_array, labels_flat))
+        else:
+            sil_score = float("nan")
+            ch_score = float("nan")
         cluster_sizes = {int(u): int(c) for u, c in zip(unique, counts)}
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.metrics = ClusterMetrics(
@@ -316,8 +642,8 @@ class AgriculturalZoning:
             "Clustering final completo: " f"{self.n_clusters_opt} clusters."
         )
         self.logger.info(
-            f"Métricas: Silhouette={sil_score:.4f}, "
-            f"CH={ch_score:.2f}, Inertia={inertia:.2f}."
+            f"Métricas: Silhouette={_format_metric(sil_score, '.4f')}, "
+            f"CH={_format_metric(ch_score, '.2f')}, Inertia={inertia:.2f}."
         )
 
     def extract_zone_polygons(self) -> None:
@@ -329,33 +655,39 @@ class AgriculturalZoning:
         if self.crs is None:
             raise ProcessingError("CRS no inicializado.")
 
-        height, width = self.cluster_labels.shape
-        left, bottom, right, top = self._get_bounds()
-        x_res = (right - left) / width
-        y_res = (top - bottom) / height
-
-        records: List[Dict[str, Any]] = []
-        for row in range(height):
-            for col in range(width):
-                label = int(self.cluster_labels[row, col])
-                if label == -1:
-                    continue
-
-                x0 = left + col * x_res
-                y0 = top - row * y_res
-                x1 = x0 + x_res
-                y1 = y0 - y_res
-                poly = Polygon([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
-                records.append({"cluster": label, "geometry": poly})
-
-        if not records:
+        # Un polígono por componente conexo, vectorizado en C por rasterio.
+        geoms: List[Dict[str, Any]] = []
+        values: List[int] = []
+        for geom, value in shapes(
+            self.cluster_labels,
+            mask=self.cluster_labels >= 0,
+            transform=self.transform,
+            connectivity=4,
+        ):
+            geoms.append(geom)
+            values.append(int(value))
+
+        if not geoms:
             raise ProcessingError(
                 "No se generaron polígonos de zonas " "(sin píxeles con clusters)."
             )
 
-        gdf_pixels = gpd.GeoDataFrame(records, crs=self.crs)
-        self.zones_gdf = gdf_pixels.dissolve(by="cluster").reset_index()
-        self.logger.info("Polígonos de zona extraídos y disueltos " "por cluster.")
+        polygons = _polygons_from_geojson(geoms)
+        part_labels = np.asarray(values)
+
+        # Los componentes de un cluster forman una cobertura (no se solapan),
+        # así que coverage_union_all los une en tiempo lineal sin dissolve.
+        records: List[Dict[str, Any]] = [
+            {
+                "cluster": int(cluster),
+                "geometry": shapely.coverage_union_all(
+                    polygons[part_labels == cluster]
+                ),
+            }
+            for cluster in np.unique(part_labels)
+        ]
+        self.zones_gdf = gpd.GeoDataFrame(records, crs=self.crs)
+        self.logger.info("Polígonos de zona extraídos y unidos por cluster.")
 
     def filter_small_zones(self) -> None:
         """Filtra zonas con área menor a min_zone_size_ha."""
@@ -376,30 +708,56 @@ class AgriculturalZoning:
             f"Después: {filtered_count}."
         )
 
+        kept_labels = self.zones_gdf["cluster"].to_numpy(dtype=np.int32)
+        self.zone_cluster_labels = kept_labels
         self.zones_gdf = self.zones_gdf.reset_index(drop=True)
         self.zones_gdf["cluster"] = self.zones_gdf.index.astype(int)
 
         if self.cluster_labels is not None:
-            valid_labels = set(self.zones_gdf["cluster"].values)
-            mask_unassigned = ~np.isin(self.cluster_labels, list(valid_labels))
+            # Etiqueta de cluster + 1 → id de zona tras el filtrado; -1 para
+            # "sin cluster" y para los clusters descartados por área.
+            self.zone_id_lut = np.full(
+                int(self.cluster_labels.max()) + 2, -1, dtype=np.int32
+            )
+            self.zone_id_lut[kept_labels + 1] = np.arange(
+                kept_labels.size, dtype=np.int32
+            )
+
+            # Píxeles con cluster cuya zona se descartó (los "sin cluster"
+            # fuera del predio no cuentan): una sola pasada sobre la grilla.
+            mask_unassigned = (self.cluster_labels >= 0) & (
+                self.zone_id_lut[self.cluster_labels + 1] < 0
+            )
             if np.any(mask_unassigned):
                 self.logger.warning(
                     f"Reasignando {int(np.sum(mask_unassigned))} "
                     "píxeles a zonas cercanas."
                 )
 
+    def _zone_cluster_ids(self) -> npt.NDArray[np.int64]:
+        """Etiqueta de cluster original de cada zona, en el orden de zones_gdf.
+
+        `cluster_labels`, `cluster_pixel_idx` y las estadísticas por bincount
+        usan la etiqueta original; tras `filter_small_zones` los ids de zona
+        se renumeran, así que se traducen con esta tabla.
+        """
+        if self.zones_gdf is None:
+            raise ProcessingError("No hay zonas definidas.")
+        if self.zone_cluster_labels is None:
+            # Sin filtrar, el id de zona es la etiqueta del cluster.
+            return self.zones_gdf["cluster"].to_numpy(dtype=np.int64)
+        return self.zone_cluster_labels.astype(np.int64)
+
     def _pixel_to_world_coords(self, pixels: np.ndarray) -> np.ndarray:
         """Convierte coordenadas de píxeles a coordenadas de mundo."""
         if not isinstance(self.transform, Affine):
             raise ProcessingError("Transform no inicializado.")
 
-        world_coords: List[tuple[float, float]] = []
-        a, b, c, d, e, f = self.transform.to_gdal()
-        for px, py in pixels:
-            x = a * float(px) + b * float(py) + c
-            y = d * float(px) + e * float(py) + f
-            world_coords.append((x, y))
-        return np.array(world_coords)
+        # x = a·px + b·py + c ; y = d·px + e·py + f, para todos los píxeles a la vez.
+        t = self.transform
+        coef = np.array([[t.a, t.d], [t.b, t.e]], dtype=np.float64)
+        offset = np.array([t.c, t.f], dtype=np.float64)
+        return np.asarray(pixels, dtype=np.float64) @ coef + offset
 
     def generate_sampling_points(self, points_per_zone: int) -> None:
         """Genera puntos de muestreo optimizados por inhibición para cada zona."""
@@ -411,101 +769,100 @@ class AgriculturalZoning:
             raise ProcessingError("Transform no inicializado.")
         if self.crs is None:
             raise ProcessingError("CRS no inicializado.")
+        if self.width is None:
+            raise ProcessingError("Dimensiones no inicializadas.")
 
         np.random.seed(self.random_state)
-        samples_list: List[Dict[str, Any]] = []
+        selected_pixels: List[npt.NDArray[np.intp]] = []
+        selected_zones: List[npt.NDArray[np.int64]] = []
 
-        for zone_id in self.zones_gdf["cluster"]:
-            zone_mask = self.cluster_labels == int(zone_id)
-            if not np.any(zone_mask):
-                continue
-
-            ys, xs = np.where(zone_mask)
-            if xs.size == 0:
+        for zone_id, cluster_id in zip(
+            self.zones_gdf["cluster"], self._zone_cluster_ids()
+        ):
+            pixel_idx = self.cluster_pixel_idx.get(int(cluster_id))
+            if pixel_idx is None or pixel_idx.size == 0:
                 continue
 
-            pixel_coords = np.column_stack((xs, ys))
-            world_coords = self._pixel_to_world_coords(pixel_coords)
-            n_points = max(points_per_zone, int(np.sqrt(xs.size)))
-            if n_points >= xs.size:
-                selected_idxs = list(range(xs.size))
+            n_points = max(points_per_zone, int(np.sqrt(pixel_idx.size)))
+            if n_points >= pixel_idx.size:
+                chosen = pixel_idx
             else:
-                selected_idxs: List[int] = []
-                remaining_idxs = np.arange(xs.size)
-                first = int(np.random.choice(remaining_idxs))
-                selected_idxs.append(first)
-                remaining_idxs = np.delete(
-                    remaining_idxs, np.where(remaining_idxs == first)
-                )
-
-                while len(selected_idxs) < n_points and remaining_idxs.size > 0:
-                    sel_coords = world_coords[selected_idxs]
-                    rem_coords = world_coords[remaining_idxs]
-                    min_dists = np.min(
-                        np.linalg.norm(
-                            rem_coords[:, None, :]  # noqa: E231
-                            - sel_coords[None, :, :],  # noqa: E231
-                            axis=2,
-                        ),
-                        axis=1,
-                    )
-                    best_idx_in_rem = int(np.argmax(min_dists))
-                    best_idx = remaining_idxs[best_idx_in_rem]
-                    selected_idxs.append(best_idx)
-                    remaining_idxs = np.delete(remaining_idxs, best_idx_in_rem)
-
-            for idx in selected_idxs:
-                xw, yw = world_coords[idx]
-                px, py = pixel_coords[idx]
-                point = Point(xw, yw)
-                values = {
-                    name: float(array[int(py), int(px)])
-                    for name, array in self.indices.items()
-                }
-                samples_list.append(
-                    {"geometry": point, "cluster": int(zone_id), **values}
-                )
-
-        if not samples_list:
+                ys, xs = np.divmod(pixel_idx, self.width)
+                world_coords = self._pixel_to_world_coords(np.column_stack((xs, ys)))
+                first = int(np.random.choice(pixel_idx.size))
+                chosen = pixel_idx[
+                    _farthest_point_indices(world_coords, n_points, first)
+                ]
+            selected_pixels.append(chosen)
+            selected_zones.append(np.full(chosen.size, int(zone_id), dtype=np.int64))
+
+        if not selected_pixels:
             raise ProcessingError("No se generaron puntos de muestreo en ninguna zona.")
 
-        self.samples_gdf = gpd.GeoDataFrame(samples_list, crs=self.crs)
-        self.logger.info(f"Generados {len(samples_list)} puntos de muestreo.")
+        # Geometrías y valores de todas las zonas en bloque: una conversión de
+        # coordenadas, un `points_from_xy` y un `take` por índice.
+        flat_idx = np.concatenate(selected_pixels)
+        rows, cols = np.divmod(flat_idx, self.width)
+        coords = self._pixel_to_world_coords(np.column_stack((cols, rows)))
+        columns: Dict[str, Any] = {
+            "geometry": gpd.points_from_xy(coords[:, 0], coords[:, 1]),
+            "cluster": np.concatenate(selected_zones),
+        }
+        for name, array in self.indices.items():
+            columns[name] = np.take(array, flat_idx).astype(np.float64)
+
+        self.samples_gdf = gpd.GeoDataFrame(columns, crs=self.crs)
+        n_samples = len(self.samples_gdf)
+        self.logger.info(f"Generados {n_samples} puntos de muestreo.")
 
     def compute_zone_statistics(self) -> None:
         """Calcula estadísticas por zona: área, perímetro, compacidad."""
         if self.zones_gdf is None:
             raise ProcessingError("No hay zonas definidas para estadísticas.")
-        if self.cluster_labels is None:
+        if self.cluster_labels is None or self.valid_pixel_idx is None:
             raise ProcessingError("Etiquetas de clusters no inicializadas.")
 
-        self.zone_stats = []
-        for idx, row in self.zones_gdf.iterrows():
-            zone_id = int(row["cluster"])
-            geom = row["geometry"]
-            area_m2 = geom.area
-            area_ha = area_m2 / 10000.0
-            perimeter_m = geom.length
-            compactness = (
-                4 * np.pi * area_m2 / (perimeter_m**2) if perimeter_m > 0 else 0.0
-            )
-            mean_values: Dict[str, float] = {}
-            std_values: Dict[str, float] = {}
-            zone_mask = self.cluster_labels == zone_id
+        # Media y desviación de todos los clusters con una pasada de bincount
+        # por índice (sumas y sumas de cuadrados), sin máscaras por zona.
+        labels = np.take(self.cluster_labels, self.valid_pixel_idx)
+        n_bins = int(labels.max()) + 1
+        counts = np.bincount(labels, minlength=n_bins)
+        means: Dict[str, FloatArray] = {}
+        stds: Dict[str, FloatArray] = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
             for name, array in self.indices.items():
-                vals = array[zone_mask]
-                mean_values[name] = float(np.nanmean(vals))
-                std_values[name] = float(np.nanstd(vals))
-
-            stats = ZoneStats(
-                zone_id=zone_id,
-                area_ha=area_ha,
-                perimeter_m=perimeter_m,
-                compactness=compactness,
-                mean_values=mean_values,
-                std_values=std_values,
+                vals = np.take(array, self.valid_pixel_idx).astype(np.float64)
+                sums = np.bincount(labels, weights=vals, minlength=n_bins)
+                sq_sums = np.bincount(labels, weights=vals * vals, minlength=n_bins)
+                means[name] = sums / counts
+                stds[name] = np.sqrt(np.maximum(sq_sums / counts - means[name] ** 2, 0))
+
+        # Área y perímetro de todas las zonas en bloque (sin iterrows).
+        zone_ids = self.zones_gdf["cluster"].to_numpy(dtype=np.int64)
+        cluster_ids = self._zone_cluster_ids()
+        areas_m2 = self.zones_gdf.geometry.area.to_numpy()
+        perimeters_m = self.zones_gdf.geometry.length.to_numpy()
+        compactness = np.zeros_like(areas_m2)
+        np.divide(
+            4 * np.pi * areas_m2,
+            perimeters_m**2,
+            out=compactness,
+            where=perimeters_m > 0,
+        )
+
+        self.zone_stats = [
+            ZoneStats(
+                zone_id=int(zone_id),
+                area_ha=float(area_m2) / 10000.0,
+                perimeter_m=float(perimeter_m),
+                compactness=float(compact),
+                mean_values={name: float(m[cluster_id]) for name, m in means.items()},
+                std_values={name: float(sd[cluster_id]) for name, sd in stds.items()},
+            )
+            for zone_id, cluster_id, area_m2, perimeter_m, compact in zip(
+                zone_ids, cluster_ids, areas_m2, perimeters_m, compactness
             )
-            self.zone_stats.append(stats)
+        ]
 
         self.logger.info(f"Calculadas estadísticas para {len(self.zone_stats)} zonas.")
 
@@ -521,18 +878,58 @@ class AgriculturalZoning:
         save_dir = Path(save_dir)
         save_dir.mkdir(parents=True, exist_ok=True)
 
+        # Cada archivo es independiente y GDAL/la E/S liberan el GIL: se
+        # escriben en paralelo y se propaga el primer error al final.
+        writers = []
         if self.zones_gdf is not None:
-            zones_fp = save_dir / "zonificacion_agricola.gpkg"
-            self.zones_gdf.to_file(zones_fp, layer="zonas", driver="GPKG")
-            self.logger.info(f"Guardado archivo de zonas: {zones_fp}.")
-
+            writers.append(self._save_zones)
         if self.samples_gdf is not None:
-            samples_fp = save_dir / "puntos_muestreo.gpkg"
-            self.samples_gdf.to_file(samples_fp, layer="muestras", driver="GPKG")
-            self.logger.info(f"Guardado archivo de muestras: {samples_fp}.")
-
+            writers.append(self._save_samples)
         if self.zone_stats:
-            stats_data: List[Dict[str, Any]] = []
+            writers.append(self._save_zone_stats)
+        if self.metrics is not None:
+            writers.append(self._save_metrics)
+
+        if writers:
+            with ThreadPoolExecutor(max_workers=len(writers)) as executor:
+                futures = [executor.submit(write, save_dir) for write in writers]
+            for future in futures:
+                future.result()
+
+        self.logger.info(f"Resultados guardados en: {save_dir}.")
+
+    def _save_zones(self, save_dir: Path) -> None:
+        """Escribe las zonas en GeoPackage."""
+        if self.zones_gdf is None:
+            raise ProcessingError("No hay zonas para guardar.")
+        zones_fp = save_dir / "zonificacion_agricola.gpkg"
+        self.zones_gdf.to_file(zones_fp, layer="zonas", driver="GPKG", engine="pyogrio")
+        self.logger.info(f"Guardado archivo de zonas: {zones_fp}.")
+
+    def _save_samples(self, save_dir: Path) -> None:
+        """Escribe los puntos de muestreo en GeoPackage."""
+        if self.samples_gdf is None:
+            raise ProcessingError("No hay puntos de muestreo para guardar.")
+        samples_fp = save_dir / "puntos_muestreo.gpkg"
+        self.samples_gdf.to_file(
+            samples_fp, layer="muestras", driver="GPKG", engine="pyogrio"
+        )
+        self.logger.info(f"Guardado archivo de muestras: {samples_fp}.")
+
+    def _save_zone_stats(self, save_dir: Path) -> None:
+        """Escribe las estadísticas por zona en CSV."""
+        # Orden de columnas explícito y estable: atributos geométricos,
+        # luego medias y desviaciones en el orden de los índices.
+        index_names = list(self.zone_stats[0].mean_values)
+        fieldnames = (
+            ["zone_id", "area_ha", "perimeter_m", "compactness"]
+            + [f"{name}_mean" for name in index_names]
+            + [f"{name}_std" for name in index_names]
+        )
+        stats_fp = save_dir / "estadisticas_zonas.csv"
+        with open(stats_fp, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator="\n")
+            writer.writeheader()
             for stat in self.zone_stats:
                 row: Dict[str, Any] = {
                     "zone_id": stat.zone_id,
@@ -544,31 +941,35 @@ class AgriculturalZoning:
                     row[f"{idx_name}_mean"] = val
                 for idx_name, val in stat.std_values.items():
                     row[f"{idx_name}_std"] = val
-                stats_data.append(row)
+                writer.writerow(row)
+        self.logger.info(f"Guardado archivo de estadísticas: {stats_fp}.")
+
+    def _save_metrics(self, save_dir: Path) -> None:
+        """Escribe las métricas de clustering en JSON."""
+        if self.metrics is None:
+            raise ProcessingError("No hay métricas para guardar.")
+        metrics_data = {
+            "n_clusters": self.metrics.n_clusters,
+            "silhouette": _json_metric(self.metrics.silhouette),
+            "calinski_harabasz": _json_metric(self.metrics.calinski_harabasz),
+            "inertia": float(self.metrics.inertia),
+            "cluster_sizes": self.metrics.cluster_sizes,
+            "timestamp": self.metrics.timestamp,
+        }
+        metrics_fp = save_dir / "metricas_clustering.json"
+        with open(metrics_fp, "w") as f:
+            json.dump(metrics_data, f, indent=2)
+        self.logger.info(f"Guardado archivo de métricas: {metrics_fp}.")
+
+    def visualize_results(self, publication_quality: bool = False) -> None:
+        """Genera y salva mapas de NDVI y zonificación por clusters.
 
-            stats_df = pd.DataFrame(stats_data)
-            stats_fp = save_dir / "estadisticas_zonas.csv"
-            stats_df.to_csv(stats_fp, index=False)
-            self.logger.info(f"Guardado archivo de estadísticas: {stats_fp}.")
-
-        if self.metrics is not None:
-            metrics_data = {
-                "n_clusters": self.metrics.n_clusters,
-                "silhouette": float(self.metrics.silhouette),
-                "calinski_harabasz": float(self.metrics.calinski_harabasz),
-                "inertia": float(self.metrics.inertia),
-                "cluster_sizes": self.metrics.cluster_sizes,
-                "timestamp": self.metrics.timestamp,
-            }
-            metrics_fp = save_dir / "metricas_clustering.json"
-            with open(metrics_fp, "w") as f:
-                json.dump(metrics_data, f, indent=2)
-            self.logger.info(f"Guardado archivo de métricas: {metrics_fp}.")
-
-        self.logger.info(f"Resultados guardados en: {save_dir}.")
-
-    def visualize_results(self) -> None:
-        """Genera y salva mapas de NDVI y zonificación por clusters."""
+        Args:
+            publication_quality: Si es True, el mapa de NDVI se dibuja como
+                figura (título, barra de color, contorno del predio) a 150 dpi.
+                Por defecto el raster se escribe directo con `plt.imsave`, un
+                píxel de imagen por píxel del índice.
+        """
         if self.output_dir is None:
             self.logger.warning("output_dir no definido; no se generarán mapas.")
             return
@@ -584,58 +985,87 @@ class AgriculturalZoning:
                 if self.bounds is None:
                     raise ProcessingError("Bounds no inicializados para visualización.")
 
-                ndvi_masked = np.where(self.valid_mask, ndvi, np.nan)
-                left, bottom, right, top = self.bounds.bounds
-                x_margin = (right - left) * 0.05
-                y_margin = (top - bottom) * 0.05
-                extent = (
-                    left - x_margin,
-                    right + x_margin,
-                    bottom - y_margin,
-                    top + y_margin,
-                )
-
-                fig1, ax1 = plt.subplots(figsize=(10, 10))
-                cmap_ndvi = plt.get_cmap("RdYlGn").copy()
-                cmap_ndvi.set_bad(color="white")
-                im = ax1.imshow(
-                    ndvi_masked,
-                    cmap=cmap_ndvi,
-                    extent=extent,
-                    origin="upper",
-                )
-                ax1.set_title("Mapa de NDVI", fontsize=16, pad=15)
-                ax1.set_xticks([])
-                ax1.set_yticks([])
-                cbar = plt.colorbar(im, ax=ax1, fraction=0.036, pad=0.04)
-                cbar.set_label("NDVI", rotation=270, labelpad=15, fontsize=12)
-
-                if self.gdf_predio is not None and not self.gdf_predio.empty:
-                    self.gdf_predio.boundary.plot(ax=ax1, color="blue", linewidth=2)
-                plt.tight_layout()
+                # Arreglo enmascarado: comparte el buffer del índice en vez de
+                # copiar H×W con NaN fuera del predio.
+                ndvi_masked = np.ma.array(ndvi, mask=~self.valid_mask)
+                cmap_ndvi = plt.get_cmap("RdYlGn").with_extremes(bad="white")
                 ndvi_fp = self.output_dir / "mapa_ndvi.png"
                 ndvi_fp.parent.mkdir(parents=True, exist_ok=True)
-                plt.savefig(ndvi_fp, dpi=500, bbox_inches="tight")
-                plt.close(fig1)
+
+                if not publication_quality:
+                    plt.imsave(
+                        ndvi_fp,
+                        ndvi_masked,
+                        cmap=cmap_ndvi,
+                        vmin=float(ndvi_masked.min()),
+                        vmax=float(ndvi_masked.max()),
+                    )
+                else:
+                    left, bottom, right, top = self.bounds.bounds
+                    x_margin = (right - left) * 0.05
+                    y_margin = (top - bottom) * 0.05
+                    extent = (
+                        left - x_margin,
+                        right + x_margin,
+                        bottom - y_margin,
+                        top + y_margin,
+                    )
+
+                    fig1, ax1 = plt.subplots(figsize=(10, 10))
+                    im = ax1.imshow(
+                        ndvi_masked,
+                        cmap=cmap_ndvi,
+                        extent=extent,
+                        origin="upper",
+                    )
+                    ax1.set_title("Mapa de NDVI", fontsize=16, pad=15)
+                    ax1.set_xticks([])
+                    ax1.set_yticks([])
+                    cbar = plt.colorbar(im, ax=ax1, fraction=0.036, pad=0.04)
+                    cbar.set_label("NDVI", rotation=270, labelpad=15, fontsize=12)
+
+                    if self.gdf_predio is not None and not self.gdf_predio.empty:
+                        self.gdf_predio.boundary.plot(ax=ax1, color="blue", linewidth=2)
+                    plt.tight_layout()
+                    plt.savefig(ndvi_fp, dpi=150, bbox_inches="tight")
+                    plt.close(fig1)
                 self.logger.info(f"Mapa de NDVI guardado en: {ndvi_fp}.")
 
             # Mapa de clusters
-            if self.zones_gdf is not None and not self.zones_gdf.empty:
+            if (
+                self.zones_gdf is not None
+                and not self.zones_gdf.empty
+                and self.cluster_labels is not None
+                and self.zone_id_lut is not None
+                and isinstance(self.transform, Affine)
+            ):
+                # La grilla de zonas se dibuja con imshow, sin generar un parche
+                # de matplotlib por cada polígono. Se traduce a ids de zona tras
+                # el filtrado y se enmascaran los clusters descartados, igual
+                # que en zonificacion_agricola.gpkg.
+                t = self.transform
+                extent = (
+                    t.c,
+                    t.c + t.a * self.width,
+                    t.f + t.e * self.height,
+                    t.f,
+                )
+                zones_masked = np.ma.masked_less(
+                    self.zone_id_lut[self.cluster_labels + 1], 0
+                )
                 fig2, ax2 = plt.subplots(figsize=(10, 10))
-                self.zones_gdf.plot(
-                    ax=ax2,
-                    column="cluster",
+                im2 = ax2.imshow(
+                    zones_masked,
                     cmap="viridis",
-                    edgecolor="black",
-                    linewidth=0.5,
+                    norm=Normalize(
+                        vmin=float(self.zones_gdf["cluster"].min()),
+                        vmax=float(self.zones_gdf["cluster"].max()),
+                    ),
+                    extent=extent,
+                    origin="upper",
+                    interpolation="nearest",
                 )
-
-                vmin = float(self.zones_gdf["cluster"].min())
-                vmax = float(self.zones_gdf["cluster"].max())
-                norm = Normalize(vmin=vmin, vmax=vmax)
-                sm = plt.cm.ScalarMappable(cmap="viridis", norm=norm)
-                sm.set_array([])
-                cbar = plt.colorbar(sm, ax=ax2, fraction=0.036, pad=0.04)
+                cbar = plt.colorbar(im2, ax=ax2, fraction=0.036, pad=0.04)
                 cbar.set_label("Cluster", rotation=270, labelpad=15, fontsize=12)
 
                 ax2.set_title("Zonificación por Clusters", fontsize=16, pad=15)
@@ -717,6 +1147,250 @@ class AgriculturalZoning:
         )
 
 
+def mask_to_polygon(mask: npt.NDArray[np.uint8], transform: Affine) -> BaseGeometry:
+    """Deriva el polígono del predio a partir de una máscara binaria (0/1).
+
+    Los componentes conexos que entrega `shapes` son disjuntos por
+    construcción, así que se agrupan directamente en un MultiPolygon sin
+    pasar por `unary_union`.
+
+    La máscara se poligoniza a resolución completa y sin `sieve`:
+    `run_pipeline` deriva el transform de la grilla a partir de los límites
+    de este polígono y recorta con él, así que submuestrear o eliminar
+    píxeles aislados del borde desplazaría la grilla y cambiaría los píxeles
+    válidos.
+    """
+    geoms = [
+        geom_geojson
+        for geom_geojson, val in shapes(mask, mask=mask, transform=transform)
+        if val == 1
+    ]
+    if not geoms:
+        raise ProcessingError(
+            "No se pudo derivar polígono: todos los píxeles están en 0."
+        )
+    polygons = _polygons_from_geojson(geoms)
+    if len(polygons) == 1:
+        return polygons[0]
+    return MultiPolygon(list(polygons))
+
+
+def raster_mask_to_polygon(
+    src: rasterio.io.DatasetReader, band: int = 1
+) -> BaseGeometry:
+    """Deriva el polígono del predio (píxeles > 0 de `band`) leyendo por ventanas.
+
+    El raster se recorre en franjas de ancho completo alineadas a sus bloques
+    internos, de modo que nunca se carga la banda entera; cada franja se
+    poligoniza con su propio transform y los fragmentos se unen al final.
+    """
+    block_rows = src.block_shapes[band - 1][0]
+    step = max(block_rows, (MASK_READ_ROWS // block_rows) * block_rows)
+
+    parts: List[Dict[str, Any]] = []
+    for row_off in range(0, src.height, step):
+        window = Window(0, row_off, src.width, min(step, src.height - row_off))
+        # bool → uint8 sin copia: el resultado de la comparación es contiguo.
+        mask = (src.read(band, window=window) > 0).view(np.uint8)
+        parts.extend(
+            geom_geojson
+            for geom_geojson, val in shapes(
+                mask, mask=mask, transform=src.window_transform(window)
+            )
+            if val == 1
+        )
+    if not parts:
+        raise ProcessingError(
+            "No se pudo derivar polígono: todos los píxeles están en 0."
+        )
+    return shapely.unary_union(_polygons_from_geojson(parts))
+
+
+def _safe_divide(
+    a: Float32Array,
+    b: Float32Array,
+    valid: BoolArray,
+    out: Optional[Float32Array] = None,
+) -> Float32Array:
+    """Calcula (a - b)/(a + b) en float32 solo donde `valid`; el resto queda en 0.
+
+    `out` es un buffer opcional de la misma forma que `a` para escribir el
+    resultado sin asignar memoria.
+    """
+    if out is None:
+        out = np.empty_like(a, dtype=np.float32)
+    out.fill(0.0)
+    np.subtract(a, b, out=out, where=valid)
+    den = np.add(a, b)
+    # Fuera de `valid` queda el 0 inicial; no hace falta otra pasada de limpieza.
+    # Dentro de `valid` el denominador es > 0, así que no hay avisos que silenciar.
+    np.divide(out, den, out=out, where=valid)
+    return out
+
+
+def _indices_loop(
+    nir: Float32Array,
+    red: Float32Array,
+    green: Float32Array,
+    red_edge: Float32Array,
+    swir: Float32Array,
+    ndvi: Float32Array,
+    ndwi: Float32Array,
+    ndre: Float32Array,
+    si: Float32Array,
+) -> None:
+    """Calcula NDVI, NDWI, NDRE y SI en una sola pasada sobre las bandas.
+
+    Misma regla que `_safe_divide`: un píxel es válido solo si todas las
+    bandas son > 0 (NaN incluido queda fuera); los inválidos quedan en 0.
+    Las filas se reparten entre hilos con `prange` cuando numba compila.
+    """
+    rows, cols = nir.shape
+    for i in prange(rows):
+        for j in range(cols):
+            n = nir[i, j]
+            r = red[i, j]
+            g = green[i, j]
+            re = red_edge[i, j]
+            sw = swir[i, j]
+            if n > 0 and r > 0 and g > 0 and re > 0 and sw > 0:
+                ndvi[i, j] = (n - r) / (n + r)
+                ndwi[i, j] = (g - n) / (g + n)
+                ndre[i, j] = (n - re) / (n + re)
+                si[i, j] = (sw - n) / (sw + n)
+            else:
+                ndvi[i, j] = 0.0
+                ndwi[i, j] = 0.0
+                ndre[i, j] = 0.0
+                si[i, j] = 0.0
+
+
+# Sin fastmath: la comparación `> 0` debe seguir descartando NaN.
+_indices_kernel = (
+    njit(parallel=True, cache=True)(_indices_loop) if njit is not None else None
+)
+
+
+def _load_raster_inputs(
+    raster_path: Path,
+) -> tuple[Dict[str, Float32Array], BaseGeometry, str]:
+    """Lee el TIFF del predio y deriva índices, polígono del predio y CRS."""
+    with rasterio.open(raster_path) as src:
+        crs = src.crs.to_string() if src.crs is not None else ""
+        transform = src.transform
+        img = src.read()  # [B11, B8, B5, B4, B3, B2]
+
+    # La banda 1 ya leída define la máscara del predio.
+    mask_valid = (img[0] > 0).view(np.uint8)
+    poly = mask_to_polygon(mask_valid, transform)
+
+    bands = {
+        "swir": img[0].astype(np.float32),
+        "nir": img[1].astype(np.float32),
+        "red_edge": img[2].astype(np.float32),
+        "red": img[3].astype(np.float32),
+        "green": img[4].astype(np.float32),
+    }
+
+    # Los cuatro índices son vistas de un único bloque (4, H, W) preasignado.
+    index_block = np.empty((len(INDEX_PAIRS),) + bands["nir"].shape, dtype=np.float32)
+    indices_dict: Dict[str, Float32Array] = dict(zip(INDEX_PAIRS, index_block))
+
+    if _indices_kernel is not None:
+        _indices_kernel(
+            bands["nir"],
+            bands["red"],
+            bands["green"],
+            bands["red_edge"],
+            bands["swir"],
+            indices_dict["NDVI"],
+            indices_dict["NDWI"],
+            indices_dict["NDRE"],
+            indices_dict["SI"],
+        )
+        return indices_dict, poly, crs
+
+    # Con todas las bandas > 0 cada denominador (a + b) es > 0, así que una
+    # sola máscara (los píxeles en 0 son nodata) sirve para los cuatro índices.
+    # NaN > 0 es falso: los NaN de entrada también quedan fuera de la máscara.
+    valid = bands["swir"] > 0
+    for name in ("nir", "red_edge", "red", "green"):
+        valid &= bands[name] > 0
+
+    # Los ufuncs de NumPy liberan el GIL: los cuatro índices se calculan en
+    # hilos, cada uno con su propio buffer de denominador.
+    with ThreadPoolExecutor(max_workers=len(INDEX_PAIRS)) as executor:
+        futures = [
+            executor.submit(
+                _safe_divide, bands[band_a], bands[band_b], valid, indices_dict[name]
+            )
+            for name, (band_a, band_b) in INDEX_PAIRS.items()
+        ]
+        for future in futures:
+            future.result()
+
+    return indices_dict, poly, crs
+
+
+def _replace_atomically(target: Path, write: Callable[[IO[bytes]], Any]) -> None:
+    """Escribe `target` vía un temporal en la misma carpeta y `os.replace`.
+
+    Un lector concurrente ve el archivo anterior o el completo, nunca uno a
+    medio escribir.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp_name, target)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _load_raster_inputs_cached(
+    raster_path: Path, cache_dir: Path
+) -> tuple[Dict[str, Float32Array], BaseGeometry, str]:
+    """Como `_load_raster_inputs`, pero reutiliza una caché en disco.
+
+    Cada entrada se llama `{ruta}-{estado}`: `ruta` es un hash de la ruta del
+    TIFF y `estado` uno de su fecha de modificación y RASTER_CACHE_VERSION,
+    de modo que cualquier cambio en el archivo o en el cálculo de los índices
+    invalida la entrada. Se guardan los índices y el CRS en `.npz` y el
+    polígono en `.wkb`; al escribir una entrada nueva se borran las
+    anteriores del mismo TIFF.
+    """
+    raster_path = Path(raster_path).resolve()
+    path_key = hashlib.sha256(str(raster_path).encode()).hexdigest()[:32]
+    state_key = hashlib.sha256(
+        f"{RASTER_CACHE_VERSION}:{os.path.getmtime(raster_path)}".encode()
+    ).hexdigest()[:32]
+    cache_dir = Path(cache_dir)
+    npz_fp = cache_dir / f"{path_key}-{state_key}.npz"
+    wkb_fp = cache_dir / f"{path_key}-{state_key}.wkb"
+
+    if npz_fp.exists() and wkb_fp.exists():
+        with np.load(npz_fp, allow_pickle=False) as data:
+            crs = str(data["__crs__"])
+            indices_dict = {
+                name: data[name] for name in data.files if name != "__crs__"
+            }
+        poly = shapely.from_wkb(wkb_fp.read_bytes())
+        return indices_dict, poly, crs
+
+    indices_dict, poly, crs = _load_raster_inputs(raster_path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale_fp in cache_dir.glob(f"{path_key}-*"):
+        if stale_fp.suffix in (".npz", ".wkb") and stale_fp not in (npz_fp, wkb_fp):
+            stale_fp.unlink(missing_ok=True)
+
+    payload: Dict[str, Any] = {"__crs__": np.array(crs), **indices_dict}
+    # El .wkb primero: una entrada se usa solo si existen ambos archivos.
+    _replace_atomically(wkb_fp, lambda fh: fh.write(shapely.to_wkb(poly)))
+    _replace_atomically(npz_fp, lambda fh: np.savez(fh, **payload))
+    return indices_dict, poly, crs
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -761,55 +1435,24 @@ if __name__ == "__main__":
         help="Si se especifica, fuerza ese número de clusters.",
     )
 
-    args = parser.parse_args()
-    from rasterio.features import shapes as rio_shapes  # noqa: F401
-    from shapely.ops import unary_union as shapely_unary_union  # noqa: F401
-
-    with rasterio.open(args.raster) as src:
-        crs = src.crs.to_string() if src.crs is not None else ""
-        img = src.read()  # [B11, B8, B5, B4, B3, B2]
-    bands = {
-        "swir": img[0].astype(np.float64),
-        "nir": img[1].astype(np.float64),
-        "red_edge": img[2].astype(np.float64),
-        "red": img[3].astype(np.float64),
-        "green": img[4].astype(np.float64),
-    }
-
-    def safe_divide(a: FloatArray, b: FloatArray) -> FloatArray:
-        """Calcula índice normalizado de forma segura manejando división por cero."""
-        with np.errstate(divide="ignore", invalid="ignore"):
-            result = np.divide(
-                a - b,
-                a + b,
-                out=np.zeros_like(a, dtype=np.float64),
-                where=(a + b) != 0,
-            )
-            result = np.nan_to_num(result, nan=0.0)
-        return result
-
-    indices_dict: Dict[str, FloatArray] = {
-        "NDVI": safe_divide(bands["nir"], bands["red"]),
-        "NDWI": safe_divide(bands["green"], bands["nir"]),
-        "NDRE": safe_divide(bands["nir"], bands["red_edge"]),
-        "SI": safe_divide(bands["swir"], bands["nir"]),
-    }
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help=(
+            "Carpeta de caché para índices y polígono del TIFF; "
+            "acelera ejecuciones repetidas (por defecto: sin caché)."
+        ),
+    )
 
-    with rasterio.open(args.raster) as src:
-        transform = src.transform
-        banda1 = src.read(1)
-        mask_valid = (banda1 > 0).astype(np.uint8)
-        geoms = []
-        for geom_geojson, val in shapes(
-            mask_valid, mask=mask_valid, transform=transform
-        ):
-            if val == 1:
-                geoms.append(shape(geom_geojson))
-        if not geoms:
-            raise ProcessingError(
-                "No se pudo derivar polígono: todos los píxeles están en 0."
+    args = parser.parse_args()
+    with rasterio.Env(**gdal_env_options(args.raster)):
+        if args.cache_dir is not None:
+            indices_dict, poly, crs = _load_raster_inputs_cached(
+                Path(args.raster), Path(args.cache_dir)
             )
-        poly = unary_union(geoms)
+        else:
+            indices_dict, poly, crs = _load_raster_inputs(Path(args.raster))
 
     engine = AgriculturalZoning(
         random_state=42,
@@ -829,19 +1472,27 @@ if __name__ == "__main__":
 
     engine.logger.info("=== Resumen de métricas de clustering ===")
     engine.logger.info(f"  Número de clusters: {result.metrics.n_clusters}")
-    engine.logger.info(f"  Silhouette: {result.metrics.silhouette:.4f}")
     engine.logger.info(
-        f"  Calinski-Harabasz: " f"{result.metrics.calinski_harabasz:.2f}"
+        f"  Silhouette: {_format_metric(result.metrics.silhouette, '.4f')}"
+    )
+    engine.logger.info(
+        "  Calinski-Harabasz: "
+        f"{_format_metric(result.metrics.calinski_harabasz, '.2f')}"
     )
     engine.logger.info(f"  Inertia: {result.metrics.inertia:.2f}")
     engine.logger.info(f"  Tamaños de clusters: " f"{result.metrics.cluster_sizes}")
 
-    engine.logger.info("=== Estadísticas por zona (primeras 5 zonas) ===")
-    for stat in result.stats[:5]:
-        engine.logger.info(
-            f"  Zona {stat.zone_id}: Área={stat.area_ha:.3f} ha, "
-            f"Perímetro={stat.perimeter_m:.2f} m, "
-            f"Compacidad={stat.compactness:.4f}, "
-            f"Media NDVI={stat.mean_values['NDVI']:.4f}, "
-            f"Std NDVI={stat.std_values['NDVI']:.4f}"
-        )
+    # Una sola tabla en un único mensaje de log, en vez de una línea por zona.
+    stats_table = [
+        f"  {'Zona':>4} {'Área (ha)':>10} {'Perímetro (m)':>14} "
+        f"{'Compacidad':>10} {'Media NDVI':>10} {'Std NDVI':>9}"
+    ]
+    stats_table.extend(
+        f"  {stat.zone_id:>4} {stat.area_ha:>10.3f} {stat.perimeter_m:>14.2f} "
+        f"{stat.compactness:>10.4f} {stat.mean_values['NDVI']:>10.4f} "
+        f"{stat.std_values['NDVI']:>9.4f}"
+        for stat in result.stats[:5]
+    )
+    engine.logger.info(
+        "=== Estadísticas por zona (primeras 5 zonas) ===\n" + "\n".join(stats_table)
+    )
@@ -5,17 +5,26 @@ from pathlib import Path
 
 import numpy as np
 import pytest
-import rasterio
+from rasterio.io import MemoryFile
 from rasterio.transform import from_origin
+from typer.testing import CliRunner
+
+from pascal_zoning.pipeline import app
 
 
 # ------------------------------------------------------------------ #
 # Generar un TIFF sintético 6-bandas de 2×2 píxeles                 #
 # ------------------------------------------------------------------ #
-def create_multiband_tif_for_workflow(path: Path) -> None:
+@pytest.fixture(scope="session")
+def multiband_tif_bytes() -> bytes:
     """
     Crea un TIFF de 6 bandas, 2×2 píxeles, con valores distintos
     en cada píxel para asegurar que K-Means pueda generar ≥2 clusters.
+
+    El TIFF se arma una sola vez por sesión en memoria (MemoryFile, /vsimem)
+    y se entrega como bytes. Igual hace falta un archivo real, porque
+    `NDVIBlockInterface` busca el .tif con glob en la carpeta de entrada, así
+    que cada test solo vuelca estos bytes a su carpeta temporal.
     """
     # Construimos un arreglo 6×2×2 con valores 0…23
     data = np.arange(6 * 2 * 2, dtype=np.float32).reshape(6, 2, 2)
@@ -31,10 +40,10 @@ def create_multiband_tif_for_workflow(path: Path) -> None:
         "transform": transform,
     }
 
-    # Pasamos la ruta como str() y mode="w" para evitar advertencias de stub
-    with rasterio.open(str(path), mode="w", **meta) as dst:
-        for i in range(6):
-            dst.write(data[i], i + 1)
+    with MemoryFile() as memfile:
+        with memfile.open(**meta) as dst:
+            dst.write(data)
+        return memfile.read()
 
 
 # ------------------------------------------------------------------ #
@@ -69,19 +78,77 @@ def git_root(tmp_path):
     return project_dir
 
 
+EXPECTED_OUTPUTS = {
+    "zonificacion_agricola.gpkg",
+    "puntos_muestreo.gpkg",
+    "mapa_clusters.png",
+    "estadisticas_zonas.csv",
+    "metricas_clustering.json",
+    "zonificacion_results.png",
+}
+
+
+def _assert_outputs_created(outputs_dir: Path) -> None:
+    """Comprueba los archivos del (único) subdirectorio timestamped de salida."""
+    # “outputs_dir” contendrá subdirectorios timestamped como:
+    #    outputs/20250604_193139_k2_mz0.00005/
+    timestamped_dirs = [d for d in outputs_dir.iterdir() if d.is_dir()]
+    assert timestamped_dirs, "No se creó ningún subdirectorio dentro de outputs_dir"
+    exec_dir = timestamped_dirs[0]
+
+    produced = {p.name for p in exec_dir.iterdir() if p.is_file()}
+    missing = EXPECTED_OUTPUTS - produced
+    assert not missing, f"Faltan archivos en {exec_dir}: {missing}"
+
+
 # ------------------------------------------------------------------ #
 # TEST de flujo completo                                               #
 # ------------------------------------------------------------------ #
-def test_cli_workflow_creates_outputs(git_root, tmp_path):
+def test_cli_workflow_in_process(tmp_path, multiband_tif_bytes):
+    """
+    Invoca el comando `run` de la app typer en el mismo proceso (CliRunner),
+    sin lanzar un intérprete nuevo ni copiar el paquete.
+    """
+    inputs_dir = tmp_path / "inputs"
+    inputs_dir.mkdir()
+    tif_path = inputs_dir / "predio_recortado_multiband.tif"
+    tif_path.write_bytes(multiband_tif_bytes)
+    outputs_dir = tmp_path / "integration_outputs"
+
+    result = CliRunner().invoke(
+        app,
+        [
+            "run",
+            "--raster",
+            str(tif_path),
+            "--output-dir",
+            str(outputs_dir),
+            "--indices",
+            "NDVI,NDWI,NDRE,SI",
+            "--force-k",
+            "2",
+            "--min-zone-size",
+            "0.00005",
+        ],
+    )
+    assert result.exit_code == 0, f"CLI devolvió error:\n{result.output}"
+
+    _assert_outputs_created(outputs_dir)
+
+
+@pytest.mark.slow
+def test_cli_workflow_creates_outputs(git_root, tmp_path, multiband_tif_bytes):
     """
     Invoca la CLI real (`python -m pascal_zoning.pipeline run …`) con un TIFF pequeño.
     Comprueba que el proceso termine sin error y que aparezcan los archivos esperados.
+    Es la prueba de humo en un proceso aparte; el camino por defecto se cubre
+    en proceso con `test_cli_workflow_in_process`.
     """
     # 1) Crear carpeta `inputs` y el TIFF sintético
     inputs_dir = git_root / "inputs"
     inputs_dir.mkdir()
     tif_path = inputs_dir / "predio_recortado_multiband.tif"
-    create_multiband_tif_for_workflow(tif_path)
+    tif_path.write_bytes(multiband_tif_bytes)
 
     # 2) Definir directorio de salida
     outputs_dir = tmp_path / "integration_outputs"
@@ -117,22 +184,5 @@ def test_cli_workflow_creates_outputs(git_root, tmp_path):
     # Si el código de retorno no es 0, mostramos stderr para depurar
     assert proc.returncode == 0, f"CLI devolvió error:\n{proc.stderr}"
 
-    # 4) “outputs_dir” contendrá subdirectorios timestamped como:
-    #    outputs/20250604_193139_k2_mz0.00005/
-    # Capturamos el primer (y único) directorio creado allí:
-    timestamped_dirs = [d for d in outputs_dir.iterdir() if d.is_dir()]
-    assert timestamped_dirs, "No se creó ningún subdirectorio dentro de outputs_dir"
-    exec_dir = timestamped_dirs[0]
-
-    # 5) Comprobamos los nombres reales de los archivos dentro de ese subdir
-    expected = {
-        "zonificacion_agricola.gpkg",
-        "puntos_muestreo.gpkg",
-        "mapa_clusters.png",
-        "estadisticas_zonas.csv",
-        "metricas_clustering.json",
-        "zonificacion_results.png",
-    }
-    produced = {p.name for p in exec_dir.iterdir() if p.is_file()}
-    missing = expected - produced
-    assert not missing, f"Faltan archivos en {exec_dir}: {missing}"
+    # 4) Comprobamos los archivos generados en el subdirectorio timestamped
+    _assert_outputs_created(outputs_dir)
@@ -7,42 +7,20 @@ from pathlib import Path
 from pascal_zoning.interface import NDVIBlockInterface
 
 
-def test_safe_divide_nan_behavior():
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_safe_divide_nan_behavior(dtype):
     """
-    Generamos dos arrays pequeños con NaN y ceros, y validamos que
-    safe_divide(a,b) retorne NaN cuando a ó b era NaN originalmente,
-    y retorne 0.0 únicamente cuando denominador==0 pero a,b no eran NaN.
+    Llamamos NDVIBlockInterface.safe_divide con entradas float32 (núcleo
+    numba si está instalado) y float64 (ruta NumPy), y validamos que retorne
+    NaN cuando a ó b era NaN y 0.0 cuando el denominador es 0.
     """
     # Creamos un array "a" con un NaN en [0,0] y "b" sin NaN
-    a = np.array([[np.nan, 2.0], [3.0, -3.0]], dtype=float)
-    b = np.array([[1.0, 2.0], [3.0, 3.0]], dtype=float)
-
-    # Copiamos la implementación de safe_divide tal cual está en interface.py
-    def safe_divide(a_arr: np.ndarray, b_arr: np.ndarray) -> np.ndarray:
-        """
-        Calcula (a - b)/(a + b) de modo que:
-        - Si a ó b es NaN, el resultado es NaN.
-        - Si (a+b)==0, devolvemos 0.0 (para evitar división por cero),
-          pero solo cuando a,b no eran NaN originalmente.
-        """
-        mask_input_nan = np.isnan(a_arr) | np.isnan(b_arr)
-
-        with np.errstate(divide="ignore", invalid="ignore"):
-            numerador = a_arr - b_arr
-            denominador = a_arr + b_arr
-            resultado = np.divide(
-                numerador,
-                denominador,
-                out=np.zeros_like(a_arr, dtype=np.float32),
-                where=(denominador != 0),
-            )
-        # Forzamos NaN en las posiciones donde a ó b era NaN
-        resultado[mask_input_nan] = np.nan
-
-        return resultado
-
-    result = safe_divide(a, b)
+    a = np.array([[np.nan, 2.0], [3.0, -3.0]], dtype=dtype)
+    b = np.array([[1.0, 2.0], [3.0, 3.0]], dtype=dtype)
 
+    result = NDVIBlockInterface.safe_divide(a, b)
+
+    assert result.dtype == np.float32
     # 1) En [0,0], a es NaN → result[0,0] debe ser NaN
     assert np.isnan(result[0, 0])
 
@@ -56,6 +34,25 @@ def test_safe_divide_nan_behavior():
     assert result[0, 1] == pytest.approx(0.0)
 
 
+def test_safe_divide_reuses_den_buffer():
+    """
+    En la ruta NumPy, `den` recibe el denominador (a + b) y se puede
+    reutilizar entre llamadas sin alterar los resultados.
+    """
+    a = np.array([[np.nan, 1.0], [4.0, -2.0]], dtype=np.float64)
+    b = np.array([[1.0, 3.0], [0.0, 2.0]], dtype=np.float64)
+    den = np.empty(a.shape, dtype=np.float32)
+
+    first = NDVIBlockInterface.safe_divide(a, b, den)
+    np.testing.assert_array_equal(den, (a + b).astype(np.float32))
+    np.testing.assert_allclose(first, [[np.nan, -0.5], [1.0, 0.0]])
+
+    second = NDVIBlockInterface.safe_divide(b, a, den)
+    np.testing.assert_allclose(second, [[np.nan, 0.5], [-1.0, 0.0]])
+    # la salida no comparte memoria con el buffer reutilizado
+    np.testing.assert_allclose(first, [[np.nan, -0.5], [1.0, 0.0]])
+
+
 def test_validate_spectral_data_shapes_and_quality(synthetic_indices_2x2):
     """
     Validamos validate_spectral_data():
@@ -4,9 +4,17 @@
 # sin depender de helpers internos que ya no existen
 # ( _preprocess_features, _create_zone_polygons, etc.).
 
+import json
+import logging
+import os
+
+import matplotlib.pyplot as plt
 import numpy as np
 import pytest
-from shapely.geometry import Polygon
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from shapely.geometry import MultiPolygon, Polygon
 import geopandas as gpd
 
 from pascal_zoning.zoning import (
@@ -15,6 +23,13 @@ from pascal_zoning.zoning import (
     ZoneStats,
     ZoningResult,
     ProcessingError,
+    INDEX_PAIRS,
+    _farthest_point_indices,
+    _load_raster_inputs,
+    _load_raster_inputs_cached,
+    gdal_env_options,
+    mask_to_polygon,
+    raster_mask_to_polygon,
 )
 
 # ------------------------------------------------------------------ #
@@ -39,6 +54,45 @@ def bounds_polygon():
     return Polygon([(0, 0), (2, 0), (2, 2), (0, 2)])
 
 
+@pytest.fixture
+def three_blob_features():
+    """
+    Fábrica de features float32 con tres grupos bien separados en 2-D
+    (k óptimo = 3); recibe el número de píxeles por grupo.
+    """
+
+    def _make(n_per_blob):
+        rng = np.random.default_rng(0)
+        centers = np.repeat([-2.0, 0.0, 2.0], n_per_blob)
+        features = centers[:, None] + rng.normal(0.0, 0.05, size=(centers.size, 2))
+        return features.astype(np.float32)
+
+    return _make
+
+
+@pytest.fixture
+def field_tif(tmp_path):
+    """TIFF de 6 bandas 8×8 con un predio de 6×6 píxeles (el borde es nodata)."""
+    rng = np.random.default_rng(0)
+    img = rng.uniform(100.0, 3000.0, size=(6, 8, 8)).astype(np.float32)
+    img[:, [0, -1], :] = 0.0
+    img[:, :, [0, -1]] = 0.0
+    img[3, 3, 3] = 0.0  # rojo en 0 dentro del predio: píxel sin índices
+    tif_fp = tmp_path / "predio.tif"
+    profile = dict(
+        driver="GTiff",
+        width=8,
+        height=8,
+        count=6,
+        dtype="float32",
+        crs="EPSG:32719",
+        transform=from_origin(0, 80, 10, 10),
+    )
+    with rasterio.open(tif_fp, "w", **profile) as dst:
+        dst.write(img)
+    return tif_fp
+
+
 # ------------------------------------------------------------------ #
 # --------------------------- PRUEBAS ------------------------------- #
 # ------------------------------------------------------------------ #
@@ -69,12 +123,17 @@ def test_run_pipeline_basic(synthetic_indices_2x2, bounds_polygon, tmp_path):
     assert isinstance(result.samples, gpd.GeoDataFrame)
     assert not result.zones.empty
     assert not result.samples.empty
+    # los puntos deben caer sobre las zonas (coordenadas de mundo correctas)
+    assert result.samples.intersects(result.zones.unary_union).all()
 
     # ------------- métricas de clustering ------------- #
     assert isinstance(result.metrics, ClusterMetrics)
     assert result.metrics.n_clusters == 2
-    assert -1.0 <= result.metrics.silhouette <= 1.0
-    assert result.metrics.calinski_harabasz >= 0.0
+    # con k forzado no se calculan Silhouette ni CH
+    assert np.isnan(result.metrics.silhouette)
+    assert np.isnan(result.metrics.calinski_harabasz)
+    assert result.metrics.inertia >= 0.0
+    assert sum(result.metrics.cluster_sizes.values()) > 0
 
     # ------------- estadísticas de zona -------------- #
     assert isinstance(result.stats, list)
@@ -136,3 +195,310 @@ def test_files_are_created(tmp_path, bounds_polygon, synthetic_indices_2x2):
     }
     produced = {p.name for p in tmp_path.iterdir()}
     assert expected.issubset(produced), f"Faltan archivos: {expected - produced}"
+
+    # con k forzado las métricas no calculadas se escriben como null (JSON válido)
+    metrics = json.loads((tmp_path / "metricas_clustering.json").read_text())
+    assert metrics["silhouette"] is None
+    assert metrics["calinski_harabasz"] is None
+
+
+def test_select_optimal_clusters_large_raster(three_blob_features):
+    """
+    Con más píxeles que SILHOUETTE_SAMPLE_SIZE y tres grupos bien separados,
+    la selección automática debe recuperar k=3.
+    """
+    zoning = AgriculturalZoning(random_state=0, max_zones=5)
+    zoning.features_array = three_blob_features(2400)
+
+    assert zoning.select_optimal_clusters() == 3
+
+
+def test_select_optimal_clusters_simplified_silhouette(
+    monkeypatch, three_blob_features
+):
+    """Sobre el umbral de píxeles, la Silhouette simplificada elige el mismo k."""
+    monkeypatch.setattr("pascal_zoning.zoning.SIMPLIFIED_SILHOUETTE_MIN_SAMPLES", 1000)
+
+    zoning = AgriculturalZoning(random_state=0, max_zones=5, n_jobs=1)
+    zoning.features_array = three_blob_features(600)
+
+    assert zoning.select_optimal_clusters() == 3
+
+
+def test_mask_to_polygon_disjoint_fragments():
+    """
+    Dos bloques de píxeles separados producen un MultiPolygon válido
+    cuya área coincide con el número de píxeles en 1.
+    """
+    mask = np.zeros((4, 5), dtype=np.uint8)
+    mask[:2, :2] = 1
+    mask[2:, 3:] = 1
+
+    poly = mask_to_polygon(mask, from_origin(0, 4, 1, 1))
+
+    assert isinstance(poly, MultiPolygon)
+    assert poly.is_valid
+    assert len(poly.geoms) == 2
+    assert poly.area == pytest.approx(8.0)
+
+    with pytest.raises(ProcessingError):
+        mask_to_polygon(np.zeros((2, 2), dtype=np.uint8), from_origin(0, 2, 1, 1))
+
+
+def test_raster_mask_to_polygon_matches_full_read(monkeypatch):
+    """
+    Poligonizar por franjas de bloques da el mismo predio que la máscara
+    completa, incluso con un hueco y fragmentos que cruzan varias franjas.
+    """
+    band = np.zeros((70, 40), dtype=np.uint16)
+    band[5:60, 3:30] = 1
+    band[20:30, 10:15] = 0
+    band[62:70, 32:38] = 1
+    transform = from_origin(0, 70, 1, 1)
+
+    monkeypatch.setattr("pascal_zoning.zoning.MASK_READ_ROWS", 16)
+    profile = dict(
+        driver="GTiff",
+        width=40,
+        height=70,
+        count=1,
+        dtype="uint16",
+        transform=transform,
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+    )
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(band, 1)
+        with memfile.open() as src:
+            poly = raster_mask_to_polygon(src)
+
+    expected = mask_to_polygon((band > 0).astype(np.uint8), transform)
+    assert poly.is_valid
+    assert poly.symmetric_difference(expected).area == pytest.approx(0.0)
+
+
+def test_pca_is_opt_in(synthetic_indices_2x2, bounds_polygon):
+    """PCA solo se instancia y aplica cuando se pide con use_pca=True."""
+    assert AgriculturalZoning().pca is None
+
+    zoning = AgriculturalZoning(min_zone_size_ha=0.0, use_pca=True)
+    res = zoning.run_pipeline(
+        indices=synthetic_indices_2x2,
+        bounds=bounds_polygon,
+        points_per_zone=2,
+        crs="EPSG:32719",
+        force_k=2,
+    )
+    assert zoning.pca is not None
+    assert zoning.features_array.shape[1] == zoning.pca.n_components_
+    assert not res.zones.empty
+
+
+def test_features_are_contiguous_float32(synthetic_indices_2x2, bounds_polygon):
+    """La matriz de características llega a KMeans como float32 contigua."""
+    zoning = AgriculturalZoning(min_zone_size_ha=0.0)
+    zoning.run_pipeline(
+        indices=synthetic_indices_2x2,
+        bounds=bounds_polygon,
+        points_per_zone=2,
+        crs="EPSG:32719",
+        force_k=2,
+    )
+    assert zoning.features_array.dtype == np.float32
+    assert zoning.features_array.flags.c_contiguous
+
+
+def test_select_optimal_clusters_stops_early(caplog, three_blob_features):
+    """Tras el pico de Silhouette, el barrido no evalúa todos los k."""
+    zoning = AgriculturalZoning(random_state=0, max_zones=10, n_jobs=1)
+    zoning.features_array = three_blob_features(300)
+
+    with caplog.at_level(logging.INFO, logger="AgriculturalZoning"):
+        assert zoning.select_optimal_clusters() == 3
+    assert "k=6:" not in caplog.text
+    assert "Búsqueda detenida en k=5" in caplog.text
+
+
+def test_raster_cache_hit(field_tif, tmp_path, monkeypatch):
+    """La segunda lectura sale de la caché con los mismos índices, predio y CRS."""
+    cache_dir = tmp_path / "cache"
+    indices, poly, crs = _load_raster_inputs_cached(field_tif, cache_dir)
+
+    def _no_read(raster_path):
+        raise AssertionError("no debería releer el TIFF")
+
+    monkeypatch.setattr("pascal_zoning.zoning._load_raster_inputs", _no_read)
+    cached, cached_poly, cached_crs = _load_raster_inputs_cached(field_tif, cache_dir)
+
+    assert cached_crs == crs == "EPSG:32719"
+    assert cached_poly.equals(poly)
+    assert list(cached) == list(indices)
+    for name, arr in indices.items():
+        np.testing.assert_array_equal(cached[name], arr)
+
+
+def test_raster_cache_invalidated_by_mtime(field_tif, tmp_path, monkeypatch):
+    """Si cambia la fecha de modificación del TIFF, se relee y se reemplaza."""
+    import pascal_zoning.zoning as zoning_mod
+
+    cache_dir = tmp_path / "cache"
+    calls = []
+    original = zoning_mod._load_raster_inputs
+
+    def _counting(raster_path):
+        calls.append(raster_path)
+        return original(raster_path)
+
+    monkeypatch.setattr("pascal_zoning.zoning._load_raster_inputs", _counting)
+    _load_raster_inputs_cached(field_tif, cache_dir)
+    _load_raster_inputs_cached(field_tif, cache_dir)
+    assert len(calls) == 1
+
+    mtime = os.path.getmtime(field_tif)
+    os.utime(field_tif, (mtime + 10, mtime + 10))
+    _load_raster_inputs_cached(field_tif, cache_dir)
+    assert len(calls) == 2
+    # la entrada reemplazada se borra y no quedan temporales de escritura
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+    assert len(list(cache_dir.glob("*.wkb"))) == 1
+    assert not list(cache_dir.glob("*.tmp"))
+
+
+def test_cluster_map_masks_dropped_zones(tmp_path, monkeypatch, caplog):
+    """
+    El mapa de clusters muestra solo las zonas que sobreviven al filtrado por
+    área, con sus ids renumerados, igual que el GeoPackage de zonas.
+    """
+    labels = np.array(
+        [[0, 0, 2, 2], [0, 0, 2, 2], [0, 1, 2, 2], [0, 0, 2, 2]], dtype=np.int32
+    )
+    zoning = AgriculturalZoning(min_zone_size_ha=2.0, output_dir=tmp_path)
+    zoning.cluster_labels = labels
+    zoning.height, zoning.width = labels.shape
+    zoning.transform = from_origin(0, 400, 100, 100)  # 1 ha por píxel
+    zoning.crs = "EPSG:32719"
+    zoning.extract_zone_polygons()
+    with caplog.at_level(logging.WARNING, logger="AgriculturalZoning"):
+        zoning.filter_small_zones()
+    assert zoning.zones_gdf["cluster"].tolist() == [0, 1]
+    # solo el píxel del cluster 1 descartado queda sin zona
+    assert "Reasignando 1 píxeles" in caplog.text
+
+    drawn = []
+    original_imshow = plt.Axes.imshow
+
+    def _capture(self, X, *args, **kwargs):
+        drawn.append(X)
+        return original_imshow(self, X, *args, **kwargs)
+
+    monkeypatch.setattr(plt.Axes, "imshow", _capture)
+    zoning.visualize_results()
+
+    (zone_grid,) = drawn
+    expected = np.ma.masked_less(
+        np.array(
+            [[0, 0, 1, 1], [0, 0, 1, 1], [0, -1, 1, 1], [0, 0, 1, 1]], dtype=np.int32
+        ),
+        0,
+    )
+    np.testing.assert_array_equal(zone_grid.mask, expected.mask)
+    np.testing.assert_array_equal(zone_grid.compressed(), expected.compressed())
+
+
+def test_gdal_env_keeps_sidecar_georeferencing(tmp_path):
+    """
+    Un TIFF local georreferenciado solo con un .tfw conserva su transform
+    dentro del entorno GDAL del pipeline; las opciones que ignoran archivos
+    auxiliares quedan reservadas a rutas remotas.
+    """
+    tif_fp = tmp_path / "predio.tif"
+    profile = dict(driver="GTiff", width=4, height=4, count=1, dtype="uint8")
+    with pytest.warns(rasterio.errors.NotGeoreferencedWarning):
+        with rasterio.open(tif_fp, "w", **profile) as dst:
+            dst.write(np.ones((1, 4, 4), dtype=np.uint8))
+    # Coeficientes del world file referidos al centro del píxel superior izq.
+    (tmp_path / "predio.tfw").write_text("10\n0\n0\n-10\n743955\n4500005\n")
+
+    with rasterio.Env(**gdal_env_options(tif_fp)):
+        with rasterio.open(tif_fp) as src:
+            assert src.transform.c == pytest.approx(743950.0)
+            assert src.transform.f == pytest.approx(4500010.0)
+
+    assert "GDAL_DISABLE_READDIR_ON_OPEN" not in gdal_env_options(tif_fp)
+    remote = gdal_env_options("/vsicurl/https://example.com/predio.tif")
+    assert remote["GDAL_DISABLE_READDIR_ON_OPEN"] == "EMPTY_DIR"
+
+
+def test_dropped_middle_cluster_keeps_zone_data_aligned():
+    """
+    Al descartar un cluster intermedio, las estadísticas y los puntos de cada
+    zona renumerada salen de los píxeles de su propio cluster.
+    """
+    labels = np.array(
+        [[0, 0, 2, 2], [0, 0, 2, 2], [0, 1, 2, 2], [0, 0, 2, 2]], dtype=np.int32
+    )
+    ndvi = (labels * 10.0).astype(np.float32)
+    zoning = AgriculturalZoning(random_state=0, min_zone_size_ha=2.0)
+    zoning.indices = {"NDVI": ndvi}
+    zoning.cluster_labels = labels
+    zoning.height, zoning.width = labels.shape
+    zoning.valid_pixel_idx = np.arange(labels.size)
+    flat = labels.ravel()
+    zoning.cluster_pixel_idx = {c: np.flatnonzero(flat == c) for c in (0, 1, 2)}
+    zoning.transform = from_origin(0, 400, 100, 100)  # 1 ha por píxel
+    zoning.crs = "EPSG:32719"
+
+    zoning.extract_zone_polygons()
+    zoning.filter_small_zones()
+    zoning.compute_zone_statistics()
+    zoning.generate_sampling_points(points_per_zone=2)
+
+    assert [s.mean_values["NDVI"] for s in zoning.zone_stats] == [0.0, 20.0]
+    samples = zoning.samples_gdf
+    for zone_id, expected in ((0, 0.0), (1, 20.0)):
+        zone_samples = samples[samples["cluster"] == zone_id]
+        assert not zone_samples.empty
+        assert (zone_samples["NDVI"] == expected).all()
+        zone_geom = zoning.zones_gdf.geometry[zone_id]
+        assert zone_samples.buffer(1.0).intersects(zone_geom).all()
+
+
+def test_index_paths_match(field_tif, monkeypatch):
+    """
+    El núcleo numba y la ruta NumPy por hilos (`_indices_kernel` = None)
+    calculan los mismos índices, iguales a la fórmula de referencia.
+    """
+    compiled, _, _ = _load_raster_inputs(field_tif)
+    monkeypatch.setattr("pascal_zoning.zoning._indices_kernel", None)
+    threaded, _, _ = _load_raster_inputs(field_tif)
+
+    with rasterio.open(field_tif) as src:
+        img = src.read().astype(np.float64)
+    bands = dict(zip(("swir", "nir", "red_edge", "red", "green"), img))
+    valid = (img[:5] > 0).all(axis=0)
+    for name, (band_a, band_b) in INDEX_PAIRS.items():
+        a, b = bands[band_a], bands[band_b]
+        expected = np.where(valid, (a - b) / np.where(valid, a + b, 1.0), 0.0)
+        np.testing.assert_allclose(threaded[name], expected, rtol=1e-6)
+        np.testing.assert_allclose(compiled[name], threaded[name], rtol=1e-6)
+    assert threaded["NDVI"][3, 3] == 0.0
+
+
+def test_farthest_point_paths_match(monkeypatch):
+    """
+    En una grilla regular de píxeles (muchas distancias empatadas) el núcleo
+    compilado y la ruta NumPy eligen los mismos puntos en el mismo orden.
+    """
+    ys, xs = np.mgrid[0:12, 0:15]
+    coords = np.column_stack((xs.ravel(), ys.ravel())).astype(np.float64) * 10.0
+
+    compiled = [_farthest_point_indices(coords, 20, first) for first in (0, 7, 93)]
+    monkeypatch.setattr("pascal_zoning.zoning._farthest_point_kernel", None)
+    numpy_path = [_farthest_point_indices(coords, 20, first) for first in (0, 7, 93)]
+
+    assert compiled == numpy_path
+    for picks, first in zip(numpy_path, (0, 7, 93)):
+        assert picks[0] == first
+        assert len(set(picks)) == 20